@@ -0,0 +1,176 @@
+"""
+Planner benchmark: runs RRT_STAR over every Environment scene, both robots and a fixed set of start/goal pairs,
+with seeded repetitions, and writes the per run results and per scene summaries as JSON.
+Compare two result files with --compare to spot regressions.
+    python benchmark_planner.py --repetitions 5 --output benchmark.json
+    python benchmark_planner.py --compare old_benchmark.json new_benchmark.json
+With --occupancy-grid, the UR3e checks balanced configurations with the grids build_occupancy_grid.py saved there.
+"""
+
+import argparse
+import json
+import platform
+import random
+import tracemalloc
+import numpy as np
+from src.MotionUtils.environment import Environment
+from src.MotionUtils.UR_Params import UR5e_PARAMS, UR3e_PARAMS, Transform
+from src.MotionUtils.planner import RRT_STAR
+from src.MotionUtils.building_blocks import Building_Blocks_UR3e, Building_Blocks_UR5e
+from src.MotionUtils.occupancy_grid import BalancedOccupancyGrid
+
+# consecutive waypoints of the task_path / camera_path lists of syncrhronized_balancing.py, send_both.py
+# and send_robot_to_state.py, and the run_visualize.py query
+UR3E_PAIRS = [
+    ([0.3, -1.059, -1.229, -0.81, 1.571, 1.571], [0.237, -1.844, -1.927, 0.673, 1.571, 1.571]),
+    ([-1.254, -0.182, -1.686, -1.23, 1.571, 1.571], [0.1, -0.188, -1.712, -1.198, 1.571, 1.571]),
+    ([0.1, -0.188, -1.712, -1.198, 1.571, 1.571], [-1.561, -1.446, -2.057, 0.405, 1.571, 1.571]),
+    ([-1.561, -1.446, -2.057, 0.405, 1.571, 1.571], [-1.542, -2.684, -0.751, 0.337, 1.571, 1.571]),
+    ([0.3, -1.059, -1.229, -0.874, 1.716, 1.523], [-0.406, -1.349, -1.227, -0.598, 1.3, 1.575]),
+    ([-0.619, -2.458, -1.248, 0.597, 1.566, 1.555], [0.237, -1.844, -1.927, 0.597, 1.566, 1.555]),
+]
+UR5E_PAIRS = [
+    ([-0.105, -2.148, 1.144, -1.357, -1.609, 0.111], [-0.104, -2.13, 1.144, -1.354, -1.406, 0.0]),
+    ([-0.104, -2.13, 1.144, -1.354, -1.406, 0.0], [1.141, -1.252, 0.971, -1.682, -2.777, 0.087]),
+    ([0.0, -1.554, -0.0, -0.539, -1.145, -0.0], [0.043, -1.338, 0.743, -1.646, -1.317, -0.247]),
+    ([-0.225, -1.288, 0.22, -1.341, -1.152, -0.414], [-0.409, -2.022, 0.673, -0.987, -1.832, -0.415]),
+]
+ROBOTS = {
+    'ur3e': (UR3e_PARAMS, Building_Blocks_UR3e, UR3E_PAIRS),
+    'ur5e': (UR5e_PARAMS, Building_Blocks_UR5e, UR5E_PAIRS),
+}
+
+
+def run_query(bb, start_conf, goal_conf, seed, args):
+    '''
+    Plans one query and returns its measurements. The timed run is not instrumented, tracemalloc slows
+    planning down several times, so the peak memory is measured on a second run with the same seed
+    '''
+    planner, plan = plan_query(bb, start_conf, goal_conf, seed, args)
+    stats = planner.stats.as_dict()
+    elapsed = stats.pop('elapsed')
+    peak_memory = None
+    if not args.skip_memory:
+        tracemalloc.start()
+        plan_query(bb, start_conf, goal_conf, seed, args)
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return dict(stats, seed=seed, success=len(plan) > 0, time=elapsed,
+                first_cost=stats['cost_curve'][0][1] if stats['cost_curve'] else None,
+                cost=float(planner.compute_cost(plan)) if len(plan) else None,
+                iterations_per_s=stats['iterations'] / elapsed,
+                collision_checks_per_s=stats['collision_checks'] / elapsed,
+                grid_lookups_per_s=stats['grid_lookups'] / elapsed, vertices=len(planner.tree),
+                peak_memory_mb=peak_memory)
+
+
+def plan_query(bb, start_conf, goal_conf, seed, args):
+    '''
+    Seeds the random generators and plans one query, returns the planner and the plan
+    '''
+    np.random.seed(seed)
+    random.seed(seed)
+    planner = RRT_STAR(args.step_size, args.max_itr, bb, **json.loads(args.planner_args))
+    plan = planner.find_path(np.array(start_conf), np.array(goal_conf), None, time_budget=args.time_budget)
+    return planner, plan
+
+
+def summarize(runs):
+    '''
+    Returns the success rate and the medians of the measurements of a group of runs
+    '''
+    summary = dict(runs=len(runs), success_rate=float(np.mean([run['success'] for run in runs])))
+    for key in ('time_to_first_solution', 'cost', 'time', 'iterations_per_s', 'collision_checks_per_s',
+                'grid_lookups_per_s', 'peak_memory_mb'):
+        values = [run[key] for run in runs if run[key] is not None]
+        summary[key] = float(np.median(values)) if values else None
+    return summary
+
+
+def benchmark(args):
+    results, summaries = [], []
+    for robot in args.robots:
+        params_class, bb_class, pairs = ROBOTS[robot]
+        ur_params = params_class()
+        transform = Transform(ur_params)
+        for env_idx in args.envs:
+            if not bb_class.check_obstacles and env_idx != args.envs[0]:
+                # the robot ignores the obstacles, every scene is the same benchmark
+                summaries.append(dict(robot=robot, env=env_idx,
+                                      skipped='identical to env {}, {} ignores obstacles'.format(args.envs[0], robot)))
+                continue
+            bb = bb_class(transform, ur_params, Environment(env_idx), resolution=args.resolution, p_bias=args.p_bias)
+            if args.occupancy_grid and hasattr(bb, 'occupancy_grid'):
+                # set on the instance, so the grid of one scene never leaks into another
+                bb.occupancy_grid = BalancedOccupancyGrid.load(bb, args.occupancy_grid, args.occupancy_grid_cells)
+                if bb.occupancy_grid is None:
+                    raise FileNotFoundError('no {}-cell occupancy grid for {} env {} in {}, build it with '
+                                            'build_occupancy_grid.py'.format(args.occupancy_grid_cells, robot,
+                                                                             env_idx, args.occupancy_grid))
+            for pair_idx, (start_conf, goal_conf) in enumerate(pairs):
+                scene = dict(robot=robot, env=env_idx, pair=pair_idx)
+                if bb.is_in_collision(np.array(start_conf)) or bb.is_in_collision(np.array(goal_conf)):
+                    summaries.append(dict(scene, skipped='start or goal in collision'))
+                    continue
+                runs = [dict(scene, **run_query(bb, start_conf, goal_conf, args.seed + repetition, args))
+                        for repetition in range(args.repetitions)]
+                results += runs
+                summaries.append(dict(scene, **summarize(runs)))
+                print(json.dumps(summaries[-1]))
+    return dict(settings=vars(args), python=platform.python_version(), numpy=np.__version__,
+                summaries=summaries, results=results)
+
+
+def compare(old_path, new_path):
+    '''
+    Prints the ratio new / old of the median measurements of every scene found in both result files
+    '''
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    old_summaries = {(s['robot'], s['env'], s['pair']): s for s in old['summaries'] if 'skipped' not in s}
+    for summary in new['summaries']:
+        if 'skipped' in summary:
+            continue
+        key = (summary['robot'], summary['env'], summary['pair'])
+        if key not in old_summaries:
+            continue
+        ratios = dict()
+        for name in ('time_to_first_solution', 'cost', 'iterations_per_s', 'collision_checks_per_s',
+                     'grid_lookups_per_s', 'peak_memory_mb'):
+            # results written before a measurement was added don't have it
+            if summary[name] is not None and old_summaries[key].get(name):
+                ratios[name] = round(summary[name] / old_summaries[key][name], 3)
+        print(key, 'success', old_summaries[key]['success_rate'], '->', summary['success_rate'], ratios)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RRT* benchmark over Environment scenes and robots')
+    parser.add_argument('--robots', nargs='+', default=list(ROBOTS), choices=list(ROBOTS))
+    parser.add_argument('--envs', nargs='+', type=int, default=[0, 1, 2, 3])
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first repetition')
+    parser.add_argument('--max-itr', type=int, default=1000)
+    parser.add_argument('--time-budget', type=float, default=None, help='seconds per query')
+    parser.add_argument('--step-size', type=float, default=0.5)
+    parser.add_argument('--resolution', type=float, default=0.1)
+    parser.add_argument('--p-bias', type=float, default=0.05)
+    parser.add_argument('--planner-args', default='{}', help='extra RRT_STAR keyword arguments, as JSON')
+    parser.add_argument('--skip-memory', action='store_true', help="don't measure the peak memory, which takes a "
+                                                                     "second, instrumented run of every query")
+    parser.add_argument('--occupancy-grid', metavar='DIRECTORY', default=None,
+                        help='directory of the UR3e occupancy grids, see build_occupancy_grid.py')
+    parser.add_argument('--occupancy-grid-cells', type=int, default=64)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = benchmark(args)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print('Results written to', args.output)
+
+
+if __name__ == '__main__':
+    main()
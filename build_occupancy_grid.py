@@ -0,0 +1,35 @@
+"""
+Precomputes the BalancedOccupancyGrid of the UR3e for an Environment scene, one grid per joint 4 sign, and saves it
+memory mappable under --directory. Load it onto a Building_Blocks_UR3e instance to answer collision checks of
+balanced configurations with a lookup:
+    bb.occupancy_grid = BalancedOccupancyGrid.load(bb, 'occupancy_grids', 64)
+or pass the directory to benchmark_planner.py --occupancy-grid.
+    python build_occupancy_grid.py --env 0 --cells 64 --directory occupancy_grids
+"""
+
+import argparse
+import time
+from src.MotionUtils.environment import Environment
+from src.MotionUtils.UR_Params import UR3e_PARAMS, Transform
+from src.MotionUtils.building_blocks import Building_Blocks_UR3e
+from src.MotionUtils.occupancy_grid import BalancedOccupancyGrid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UR3e balanced configuration occupancy grid')
+    parser.add_argument('--env', type=int, default=0)
+    parser.add_argument('--obstacle-model', default='spheres', choices=['spheres', 'primitives'])
+    parser.add_argument('--cells', type=int, default=64, help='cells along each of joints 0-2')
+    parser.add_argument('--directory', default='occupancy_grids')
+    args = parser.parse_args()
+    ur_params = UR3e_PARAMS()
+    bb = Building_Blocks_UR3e(Transform(ur_params), ur_params, Environment(args.env, args.obstacle_model))
+    start = time.time()
+    grid = BalancedOccupancyGrid.build(bb, args.cells)
+    path = grid.save(args.directory)
+    print('Built in {:.1f}s, cells {}'.format(time.time() - start, grid.fractions()))
+    print('Grid written to', path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
-import numpy as np
 from src.MotionUtils.environment import Environment
-from src.MotionUtils.UR_Params import UR5e_PARAMS, UR3e_PARAMS, Transform
+from src.MotionUtils.UR_Params import UR3e_PARAMS, Transform
 from src.MotionUtils.planner import RRT_STAR
-from src.MotionUtils.building_blocks import Building_Blocks_UR3e, Building_Blocks_UR5e
+from src.MotionUtils.plan_library import PlanLibrary
+from src.MotionUtils.path_shortcut import PathShortcutter
+from src.MotionUtils.building_blocks import Building_Blocks_UR3e
 
 def main():
     ur_params = UR3e_PARAMS(inflation_factor=1)
@@ -25,11 +26,15 @@ def main():
     env_goal = bb.generate_upright_configuration(atol=5e-2) # replace with actual goal
     # ---------------------------------------
     filename = 'balancing'
-    path = rrt_star_planner.find_path(start_conf=env_start, goal_conf=env_goal, filename=filename)
+    library = PlanLibrary(bb, 'plans')
+    seed_plan = library.find_path(env_start, env_goal)
+    path = rrt_star_planner.find_path(start_conf=env_start, goal_conf=env_goal, filename=filename,
+                                      seed_plan=seed_plan if len(seed_plan) else None)
+    shortcutter = PathShortcutter(bb)
+    path = shortcutter.shortcut(path)
+    print("Shortcut: cost {cost_before:.3f} -> {cost_after:.3f}, waypoints {waypoints_before} -> {waypoints_after}".format(**shortcutter.stats))
     print("Finished Planning, stepsize=", stepsize, ", path_length=",len(path), path)
-    try:
-        np.save(filename + '_path' + '.npy')
-    except:
+    if library.add(path) is None:
         print('No Path Found')
 
 
@@ -1,12 +1,80 @@
-import operator
 import numpy
+from .nearest_neighbors import WeightedNNIndex
 
 class RRTTree(object):
+    '''
+    RRTTree keeps the tree in preallocated parallel arrays: an (N, dof) array of
+    configurations and matching parent, cost-to-come, parent edge cost and depth arrays.
+    Vertices cut off from the root (see RemoveEdge) have an infinite cost-to-come.
+    Children are kept as intrusive linked lists (first child / next and previous sibling),
+    so re-parenting a vertex and updating the costs of its subtree only touch that subtree.
+    The arrays double in size when full, so adding a vertex is amortized O(1).
+    @param bb - building blocks, used for the edge cost metric
+    @param capacity - initial number of preallocated vertices
+    '''
 
-    def __init__(self, bb):
+    def __init__(self, bb, capacity=1024):
         self.bb = bb
-        self.vertices = []
-        self.edges = dict()
+        dof = len(bb.cost_weights)
+        self.configs = numpy.empty((capacity, dof), dtype=float)
+        self.parents = numpy.full(capacity, -1, dtype=int)
+        self.costs = numpy.zeros(capacity, dtype=float)
+        self.edge_costs = numpy.zeros(capacity, dtype=float)
+        self.edge_checked = numpy.ones(capacity, dtype=bool)
+        self.depths = numpy.zeros(capacity, dtype=int)
+        self.first_child = numpy.full(capacity, -1, dtype=int)
+        self.next_sibling = numpy.full(capacity, -1, dtype=int)
+        self.prev_sibling = numpy.full(capacity, -1, dtype=int)
+        self.size = 0
+        self.nn = WeightedNNIndex(bb.cost_weights)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def vertices(self):
+        '''
+        The configurations of the tree as an (N, dof) array view.
+        '''
+        return self.configs[:self.size]
+
+    @property
+    def edges(self):
+        '''
+        The tree edges as a dict from child ID to parent ID (a snapshot, read only).
+        '''
+        children = numpy.flatnonzero(self.parents[:self.size] >= 0)
+        return dict(zip(children.tolist(), self.parents[children].tolist()))
+
+    def _grow(self):
+        self.configs = numpy.concatenate((self.configs, numpy.empty_like(self.configs)))
+        for name in ('parents', 'first_child', 'next_sibling', 'prev_sibling'):
+            links = getattr(self, name)
+            setattr(self, name, numpy.concatenate((links, numpy.full(len(links), -1, dtype=int))))
+        for name in ('costs', 'edge_costs', 'edge_checked', 'depths'):
+            values = getattr(self, name)
+            setattr(self, name, numpy.concatenate((values, numpy.zeros_like(values))))
+
+    def _link(self, sid, eid):
+        head = self.first_child[sid]
+        self.parents[eid] = sid
+        self.prev_sibling[eid] = -1
+        self.next_sibling[eid] = head
+        if head >= 0:
+            self.prev_sibling[head] = eid
+        self.first_child[sid] = eid
+
+    def _unlink(self, eid):
+        sid, prev, nxt = self.parents[eid], self.prev_sibling[eid], self.next_sibling[eid]
+        if prev >= 0:
+            self.next_sibling[prev] = nxt
+        else:
+            self.first_child[sid] = nxt
+        if nxt >= 0:
+            self.prev_sibling[nxt] = prev
+        self.parents[eid] = -1
+        self.prev_sibling[eid] = -1
+        self.next_sibling[eid] = -1
 
     def GetRootID(self):
         '''
@@ -14,49 +82,147 @@ class RRTTree(object):
         '''
         return 0
 
+    def GetParent(self, vid):
+        '''
+        Returns the parent ID of a vertex, -1 for the root.
+        @param vid vertex ID
+        '''
+        return int(self.parents[vid])
+
+    def GetChildren(self, vid):
+        '''
+        Returns the IDs of the children of a vertex.
+        @param vid vertex ID
+        '''
+        children = []
+        child = self.first_child[vid]
+        while child >= 0:
+            children.append(int(child))
+            child = self.next_sibling[child]
+        return children
+
+    def GetSubtree(self, vid):
+        '''
+        Returns the IDs of the vertices under a vertex (excluding it), parents before children.
+        @param vid vertex ID
+        '''
+        subtree = self.GetChildren(vid)
+        i = 0
+        while i < len(subtree):
+            subtree.extend(self.GetChildren(subtree[i]))
+            i += 1
+        return subtree
+
     def GetNearestVertex(self, config):
         '''
         Returns the nearest state ID in the tree.
         @param config Sampled configuration.
         '''
-        dists = []
-        for v in self.vertices:
-            dists.append(self.bb.edge_cost(config, v))
-
-        vid, vdist = min(enumerate(dists), key=operator.itemgetter(1))
-
+        vid, vdist = self.nn.nearest(config)
         return vid, self.vertices[vid]
 
     def GetKNN(self, config, k):
         '''
-        Return k-nearest neighbors
+        Return k-nearest neighbors and their distances, closest first
         @param config Sampled configuration.
         @param k Number of nearest neighbors to retrieve.
         '''
-        dists = []
-        for v in self.vertices:
-            dists.append(self.bb.edge_cost(config, v))
-
-        dists = numpy.array(dists)
-        knnIDs = numpy.argpartition(dists, k)[:k]
-        # knnDists = [dists[i] for i in knnIDs]
-
-        return knnIDs, None #[self.vertices[vid] for vid in knnIDs]
+        return self.nn.knn(config, k)
 
+    def GetNearVertices(self, config, radius):
+        '''
+        Return the neighbors within the given radius and their distances, closest first
+        @param config Sampled configuration.
+        @param radius Radius in the edge_cost metric.
+        '''
+        return self.nn.radius(config, radius)
 
     def AddVertex(self, config):
         '''
         Add a state to the tree.
         @param config Configuration to add to the tree.
         '''
-        vid = len(self.vertices)
-        self.vertices.append(config)
+        if self.size == len(self.configs):
+            self._grow()
+        vid = self.size
+        self.configs[vid] = config
+        self.parents[vid] = -1
+        self.first_child[vid] = -1
+        self.next_sibling[vid] = -1
+        self.prev_sibling[vid] = -1
+        self.costs[vid] = 0
+        self.edge_costs[vid] = 0
+        self.edge_checked[vid] = True
+        self.depths[vid] = 0
+        self.size += 1
+        self.nn.add(config)
         return vid
 
-    def AddEdge(self, sid, eid):
+    def AddEdge(self, sid, eid, edge_cost=None, checked=True):
         '''
-        Adds an edge in the tree.
+        Adds an edge in the tree. If eid already has a parent it is re-parented,
+        and the cost-to-come and depth of its whole subtree are updated.
         @param sid start state ID
         @param eid end state ID
+        @param edge_cost the cost of the edge, computed with bb.edge_cost if not given
+        @param checked whether the edge was collision checked, used by lazy planning
+        '''
+        if edge_cost is None:
+            edge_cost = self.bb.edge_cost(self.configs[sid], self.configs[eid])
+        if self.parents[eid] >= 0:
+            self._unlink(eid)
+        self._link(sid, eid)
+        self.edge_costs[eid] = edge_cost
+        self.edge_checked[eid] = checked
+        self.costs[eid] = self.costs[sid] + edge_cost
+        self.depths[eid] = self.depths[sid] + 1
+        if self.first_child[eid] >= 0:
+            self.UpdateSubtree(eid)
+
+    def RemoveEdge(self, eid):
+        '''
+        Removes the edge to the parent of a vertex, cutting it and its subtree off from the root.
+        Their cost-to-come becomes infinite until they are connected again with AddEdge.
+        @param eid end state ID
+        '''
+        if self.parents[eid] >= 0:
+            self._unlink(eid)
+        self.costs[eid] = numpy.inf
+        self.depths[eid] = 0
+        self.UpdateSubtree(eid)
+
+    def UpdateSubtree(self, vid):
+        '''
+        Recomputes the cost-to-come and depth of every vertex under a vertex from its parent edges.
+        @param vid vertex ID
+        '''
+        for child in self.GetSubtree(vid):
+            parent = self.parents[child]
+            self.costs[child] = self.costs[parent] + self.edge_costs[child]
+            self.depths[child] = self.depths[parent] + 1
+
+    def Prune(self, keep):
+        '''
+        Removes all the vertices except the ones in keep, which must include the root and the parent
+        of every kept vertex. The kept vertices are renumbered in their original order.
+        Returns an array mapping the old vertex IDs to the new ones, -1 for removed vertices.
+        @param keep IDs of the vertices to keep
         '''
-        self.edges[eid] = sid
+        keep = numpy.unique(numpy.asarray(keep, dtype=int))
+        new_ids = numpy.full(self.size, -1, dtype=int)
+        new_ids[keep] = numpy.arange(len(keep))
+        parents = self.parents[keep]
+        for name in ('configs', 'costs', 'edge_costs', 'edge_checked', 'depths'):
+            values = getattr(self, name)
+            values[:len(keep)] = values[keep]
+        self.size = len(keep)
+        self.parents[:self.size] = -1
+        self.first_child[:self.size] = -1
+        self.next_sibling[:self.size] = -1
+        self.prev_sibling[:self.size] = -1
+        for vid, parent in enumerate(parents):
+            if parent >= 0:
+                self._link(new_ids[parent], vid)
+        self.nn = WeightedNNIndex(self.bb.cost_weights, capacity=len(self.configs))
+        self.nn.add_many(self.vertices)
+        return new_ids
@@ -69,6 +69,24 @@ class UR5e_PARAMS(object):
 
         self.sphere_radius = {key: val * inflation_factor for key, val in self.min_sphere_radius.items()}
 
+        # certified lower bounds on the sphere centre distance between links at least two apart, within
+        # mechanical_limits, generated offline by collision.compute_link_pair_min_distances (for tool_length=0.135).
+        # Link pairs whose bound exceeds the sum of their radii can never collide and are skipped
+        self.link_pair_min_distance = {
+                                        ('shoulder_link', 'forearm_link'): -0.1034,
+                                        ('shoulder_link', 'wrist_1_link'): -0.1309,
+                                        ('shoulder_link', 'wrist_2_link'): -0.1339,
+                                        ('shoulder_link', 'wrist_3_link'): -0.4403,
+                                        ('upper_arm_link', 'wrist_1_link'): -0.0573,
+                                        ('upper_arm_link', 'wrist_2_link'): -0.0795,
+                                        ('upper_arm_link', 'wrist_3_link'): -0.1200,
+                                        ('forearm_link', 'wrist_2_link'): 0.0099,
+                                        ('forearm_link', 'wrist_3_link'): -0.0493,
+                                        ('wrist_1_link', 'wrist_3_link'): 0.0869
+                                      }
+        if tool_length != 0.135:
+            self.link_pair_min_distance = {pair: bound for pair, bound in self.link_pair_min_distance.items() if 'wrist_3_link' not in pair}
+
 
 
 class UR3e_PARAMS(object):
@@ -149,6 +167,24 @@ class UR3e_PARAMS(object):
 
         self.sphere_radius = {key: val * inflation_factor for key, val in self.min_sphere_radius.items()}
 
+        # certified lower bounds on the sphere centre distance between links at least two apart, within
+        # mechanical_limits, generated offline by collision.compute_link_pair_min_distances (for tool_length=0.135).
+        # Link pairs whose bound exceeds the sum of their radii can never collide and are skipped
+        self.link_pair_min_distance = {
+            ('shoulder_link', 'forearm_link'): -0.0497,
+            ('shoulder_link', 'wrist_1_link'): -0.0962,
+            ('shoulder_link', 'wrist_2_link'): -0.0986,
+            ('shoulder_link', 'wrist_3_link'): -0.3192,
+            ('upper_arm_link', 'wrist_1_link'): -0.0442,
+            ('upper_arm_link', 'wrist_2_link'): -0.0591,
+            ('upper_arm_link', 'wrist_3_link'): -0.1062,
+            ('forearm_link', 'wrist_2_link'): -0.0069,
+            ('forearm_link', 'wrist_3_link'): -0.0494,
+            ('wrist_1_link', 'wrist_3_link'): 0.0712
+        }
+        if tool_length != 0.135:
+            self.link_pair_min_distance = {pair: bound for pair, bound in self.link_pair_min_distance.items() if 'wrist_3_link' not in pair}
+
 
 class Transform(object):
     '''
@@ -177,6 +213,16 @@ class Transform(object):
                 else:
                     self.local_sphere_coords[frame].append(np.array([offset[0],offset[1],sphere_offset ,1], dtype=float))
 
+        # constant terms of the batched float FK: DH parameters per joint and all the local spheres stacked
+        # in frame order, with the index of the frame each sphere belongs to
+        dh = np.array(self.ur, dtype=float)
+        self.cos_alpha, self.sin_alpha = np.cos(dh[:, 0]), np.sin(dh[:, 0])
+        self.dh_a, self.dh_d, self.theta_const = dh[:, 1], dh[:, 2], dh[:, 3]
+        self.local_sphere_array = np.array([sphere for frame in self.frame_list
+                                            for sphere in self.local_sphere_coords[frame]], dtype=float)
+        self.sphere_frame_idx = np.array([i for i, frame in enumerate(self.frame_list)
+                                          for _ in self.local_sphere_coords[frame]], dtype=int)
+
     def dh_transform(self, alpha, a, d, theta):
         return np.array([
         [np.cos(theta), -np.sin(theta) * np.cos(alpha), np.sin(theta) * np.sin(alpha), a * np.cos(theta)],
@@ -184,25 +230,37 @@ class Transform(object):
         [0, np.sin(alpha), np.cos(alpha), d],
         [0, 0, 0, 1]], dtype=float)
 
+    def get_trans_matrices(self, confs):
+        '''
+        Returns the (B, joints, 4, 4) float transformation matrices of every link frame,
+        in the base_link frame, for a batch of configurations
+        @param confs - configurations of shape (B, joints)
+        '''
+        theta = np.asarray(confs, dtype=float)[:, :len(self.ur)] + self.theta_const
+        cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+        trans = np.zeros(theta.shape + (4, 4))
+        trans[..., 0, 0] = cos_theta
+        trans[..., 0, 1] = -sin_theta
+        trans[..., 0, 3] = self.dh_a
+        trans[..., 1, 0] = sin_theta * self.cos_alpha
+        trans[..., 1, 1] = cos_theta * self.cos_alpha
+        trans[..., 1, 2] = -self.sin_alpha
+        trans[..., 1, 3] = -self.dh_d * self.sin_alpha
+        trans[..., 2, 0] = sin_theta * self.sin_alpha
+        trans[..., 2, 1] = cos_theta * self.sin_alpha
+        trans[..., 2, 2] = self.cos_alpha
+        trans[..., 2, 3] = self.dh_d * self.cos_alpha
+        trans[..., 3, 3] = 1
+        for i in range(1, len(self.ur)):
+            trans[:, i] = np.matmul(trans[:, i - 1], trans[:, i])
+        return trans
+
     def get_trans_matrix(self, conf):
         '''
         Returns the transformation matrix for given configuration
         '''
-        trans = [[] for _ in range(len(self.ur))]
-        for i in range(len(self.ur)):
-            alpha, a, d, theta_const =  self.ur[i]
-            theta = conf[i] + theta_const
-            trans[i] = np.asarray([[np.cos(theta), -np.sin(theta), 0, a],
-                                [np.sin(theta) * np.cos(alpha) , np.cos(theta) * np.cos(alpha), -np.sin(alpha), -d * np.sin(alpha)],
-                                [np.sin(theta) * np.sin(alpha) , np.cos(theta) * np.sin(alpha), np.cos(alpha),  d * np.cos(alpha)],
-                                [0,0,0,1]], dtype="object") #dtype=float
-
-        trans_matrix = dict()
-        trans_matrix['shoulder_link'] = trans[0]
-        for i in range(1, len(trans)):
-            trans_matrix[self.frame_list[i]] = np.matmul(trans_matrix[self.frame_list[i-1]] , trans[i])
-
-        return trans_matrix
+        trans = self.get_trans_matrices(np.asarray(conf, dtype=float)[None])[0]
+        return {frame: trans[i] for i, frame in enumerate(self.frame_list)}
 
     def get_global_sphere_coords(self, trans_matrix):
         '''
@@ -224,3 +282,12 @@ class Transform(object):
         '''
         trans_matrix = self.get_trans_matrix(conf)
         return self.get_global_sphere_coords(trans_matrix)
+
+    def conf2sphere_array(self, confs):
+        '''
+        Returns the (B, S, 3) sphere centres for a batch of configurations, in the base_link frame.
+        Spheres are ordered by link as in conf2sphere_coords
+        @param confs - configurations of shape (B, joints)
+        '''
+        trans = self.get_trans_matrices(confs)
+        return np.einsum('bsij,sj->bsi', trans[:, self.sphere_frame_idx, :3, :], self.local_sphere_array)
@@ -1,41 +1,77 @@
-from flask import config
 import numpy as np
 import random
-from src.MotionUtils.kinematicsUtils import config_autocomplete
-
-def sphere_collision(p1,p2,r1,r2):
-    return np.linalg.norm(np.array(p1)-np.array(p2)) < r1 + r2
+import hashlib
+from functools import lru_cache
+from src.MotionUtils.kinematicsUtils import balanced_config_autocomplete
+from src.MotionUtils.motionConstants.constants import UR3E_X_LIMIT, UR3E_Y_LIMIT
+from src.MotionUtils.collision import SphereCollisionEngine
 
 def max_angle_difference(conf1, conf2):
-    max_difference = 0
-    for angle1, angle2 in zip(conf1, conf2):
-        # normalize angles to [0, 2 * np.pi] range
-        angle1, angle2 = angle1 % (2 * np.pi), angle2 % (2 * np.pi)
-        difference = abs(angle1 - angle2)
-        # Consider the circular nature of angles
-        difference = min(difference % (2 * np.pi), (2 * np.pi - difference) % (2 * np.pi))
-        max_difference = max(max_difference, difference)
-    return max_difference
+    '''
+    Returns the largest joint angle difference between configurations, works on (..., dof) arrays as well
+    '''
+    # normalize angles to [0, 2 * np.pi] range
+    angle1, angle2 = np.asarray(conf1) % (2 * np.pi), np.asarray(conf2) % (2 * np.pi)
+    difference = np.abs(angle1 - angle2)
+    # Consider the circular nature of angles
+    difference = np.minimum(difference % (2 * np.pi), (2 * np.pi - difference) % (2 * np.pi))
+    return np.max(difference, axis=-1)
+
+@lru_cache(maxsize=None)
+def _bisection_order(n):
+    order = [0, n - 1] if n > 1 else [0]
+    segments = [(0, n - 1)]
+    while segments:
+        next_segments = []
+        for low, high in segments:
+            if high - low > 1:
+                mid = (low + high) // 2
+                order.append(mid)
+                next_segments += [(low, mid), (mid, high)]
+        segments = next_segments
+    return np.array(order)
+
+def bisection_order(n):
+    '''
+    Returns the indices 0..n-1 ordered endpoints first and then by recursive halving,
+    so any prefix of the order covers the edge roughly uniformly
+    '''
+    return _bisection_order(n).copy()
 
 
 class Building_Blocks(object):
-    def __init__(self, transform, ur_params, env, resolution=0.1, p_bias=0.05):
+    # workspace limits and obstacle checking used by is_in_collision, subclasses override them per robot
+    x_limit = 0.4
+    y_limit = None
+    check_obstacles = True
+
+    def __init__(self, transform, ur_params, env, resolution=0.1, p_bias=0.05, conservative_advancement=False,
+                 advancement_tolerance=1e-3):
         self.transform = transform
         self.ur_params = ur_params
         self.env = env
         self.resolution = resolution
         self.p_bias = p_bias
+        # check edges with advance_edges instead of at every resolution step
+        self.conservative_advancement = conservative_advancement
+        # advance_edges rejects edges that come closer than this to a collision, in metres
+        self.advancement_tolerance = advancement_tolerance
         self.cost_weights = np.array([0.4, 0.3 ,0.2 ,0.1 ,0.07 ,0.05])
+        self.collision_checks = 0 # number of configurations checked for collision, for benchmarking
+        self.grid_lookups = 0 # number of collision checks answered by an occupancy grid lookup, for benchmarking
+        self.collision_engine = SphereCollisionEngine(transform, ur_params, env, x_limit=self.x_limit,
+                                                      y_limit=self.y_limit, check_obstacles=self.check_obstacles)
 
-    def generate_upright_configuration(self,low, high):
-        c0 = np.random.uniform(low, high)
-        c1 = np.random.uniform(low, high)
-        c2 = np.random.uniform(low, high)
+    def generate_upright_configuration(self,low, high, size=None):
+        low, high = np.broadcast_to(low, 3), np.broadcast_to(high, 3)
+        c0 = np.random.uniform(low[0], high[0], size)
+        c1 = np.random.uniform(low[1], high[1], size)
+        c2 = np.random.uniform(low[2], high[2], size)
 
         bias = (np.deg2rad(0), np.deg2rad(-2.5))
         c3 = -(c1 + c2) + bias[1] - np.pi
 
-        c4 = np.random.choice([-np.pi/2, np.pi/2])
+        c4 = np.random.choice([-np.pi/2, np.pi/2], size)
 
         c5 = np.pi/2
 
@@ -45,51 +81,154 @@ class Building_Blocks(object):
         if random.random() < self.p_bias:
             return np.array(goal_conf)
         else:
-            conf = self.generate_upright_configuration(low=(-np.pi), high=(np.pi))
-            return np.array(conf)
+            return self.sample_uniform()
+
+    def sample_uniform(self, count=None, low=None, high=None) -> np.array:
+        '''
+        Returns a configuration sampled uniformly from the sampled space, without the goal bias
+        @param count - number of configurations to sample, returned as a (count, dof) array. None for a single one
+        @param low - optional (dof,) lower bounds of the joints. Only joints 0-2 are sampled freely, the others
+                     follow from them, so only these bounds are used. Defaults to -pi
+        @param high - optional (dof,) upper bounds of the joints, see low. Defaults to pi
+        '''
+        low = -np.pi if low is None else np.maximum(-np.pi, low[:3])
+        high = np.pi if high is None else np.minimum(np.pi, high[:3])
+        conf = self.generate_upright_configuration(low=low, high=high, size=count)
+        return np.stack(np.broadcast_arrays(*conf), axis=-1)
 
     def is_in_collision(self, conf) -> bool:
         """check for collision in given configuration, arm-arm and arm-obstacle
         return True if in collision
         @param conf - some configuration
         """
-        global_sphere_coords = self.transform.conf2sphere_coords(conf)
-        # arm - arm collision
-        for i in range(len(self.ur_params.ur_links) - 2):
-            for j in range(i + 2, len(self.ur_params.ur_links)):
-                spheres = global_sphere_coords[self.ur_params.ur_links[i]]
-                other_spheres = global_sphere_coords[self.ur_params.ur_links[j]]
-                for s in spheres:
-                    for s2 in other_spheres:
-                        if sphere_collision(s[0:3], s2[0:3], self.ur_params.sphere_radius[self.ur_params.ur_links[i]], self.ur_params.sphere_radius[self.ur_params.ur_links[j]]):
-                            return True
-        # arm - obstacle collision
-        for joint, spheres in global_sphere_coords.items():
-            for sphere in spheres:
-                for obstacle in self.env.obstacles:
-                    if sphere_collision(sphere[0:3], obstacle, self.ur_params.sphere_radius[joint], self.env.radius):
-                        return True
-        # arm - floor collision
-        for joint, spheres in global_sphere_coords.items():
-            if joint == self.ur_params.ur_links[0]:
-                continue
-            for sphere in spheres:
-                if sphere[2] < self.ur_params.sphere_radius[joint]:
-                    return True
-        # x - axis limit
-        for joint, spheres in global_sphere_coords.items():
-            for sphere in spheres:
-                if sphere[0] + self.ur_params.sphere_radius[joint] > 0.4:
-                    return True
-        return False
-
-    def local_planner(self, prev_conf, current_conf) -> bool:
-        '''check for collisions between two configurations - return True if transition is valid
+        self.collision_checks += 1
+        spheres = self.transform.conf2sphere_array(np.asarray(conf, dtype=float)[None])[0]
+        return bool(self.collision_engine.in_collision(spheres))
+
+    def sphere_coords_batch(self, confs):
+        '''
+        Returns the (B, S, 3) sphere centres of a batch of configurations
+        @param confs - configurations of shape (B, dof)
+        '''
+        return self.transform.conf2sphere_array(confs)
+
+    def configs_in_collision(self, confs):
+        '''
+        Batched is_in_collision, returns a boolean array that is True for configurations in collision
+        @param confs - configurations of shape (B, dof)
+        '''
+        confs = np.asarray(confs, dtype=float)
+        if len(confs) == 0:
+            return np.zeros(0, dtype=bool)
+        self.collision_checks += len(confs)
+        return self.collision_engine.in_collision(self.sphere_coords_batch(confs))
+
+    def edge_configurations(self, prev_conf, current_conf):
+        '''
+        Returns the interpolated configurations local_planner checks along an edge
         @param prev_conf - some configuration
         @param current_conf - current configuration
         '''
         number_of_configurations_to_check = max(3, int(max_angle_difference(prev_conf, current_conf) / self.resolution))
-        return not any([self.is_in_collision(np.array(conf)) for conf in np.linspace(prev_conf, current_conf, number_of_configurations_to_check, endpoint=True)])
+        return np.linspace(prev_conf, current_conf, number_of_configurations_to_check, endpoint=True)
+
+    def local_planner(self, prev_conf, current_conf, early_exit=True) -> bool:
+        '''check for collisions between two configurations - return True if transition is valid
+        @param prev_conf - some configuration
+        @param current_conf - current configuration
+        @param early_exit - check the configurations in bisection order and in growing batches, stopping at
+                            the first collision. Otherwise all configurations are checked in a single batch
+        '''
+        if self.conservative_advancement:
+            return bool(self.advance_edges(np.asarray(prev_conf, dtype=float)[None],
+                                           np.asarray(current_conf, dtype=float)[None])[0])
+        confs = self.edge_configurations(np.asarray(prev_conf, dtype=float), np.asarray(current_conf, dtype=float))
+        if not early_exit:
+            return not np.any(self.configs_in_collision(confs))
+        order = bisection_order(len(confs))
+        start, batch_size = 0, 4
+        while start < len(order):
+            if np.any(self.configs_in_collision(confs[order[start:start + batch_size]])):
+                return False
+            start += batch_size
+            batch_size *= 2
+        return True
+
+    def edges_valid(self, prev_confs, current_confs):
+        '''
+        Batched local_planner over many edges, returns a boolean array that is True for valid transitions
+        @param prev_confs - edge start configurations of shape (E, dof)
+        @param current_confs - edge end configurations of shape (E, dof)
+        '''
+        if self.conservative_advancement:
+            return self.advance_edges(prev_confs, current_confs)
+        edges = [self.edge_configurations(prev, current) for prev, current in zip(np.asarray(prev_confs, dtype=float),
+                                                                                  np.asarray(current_confs, dtype=float))]
+        if len(edges) == 0:
+            return np.zeros(0, dtype=bool)
+        collisions = self.configs_in_collision(np.concatenate(edges))
+        starts = np.cumsum([0] + [len(confs) for confs in edges[:-1]])
+        return ~np.logical_or.reduceat(collisions, starts)
+
+    def advance_edges(self, prev_confs, current_confs):
+        '''
+        Conservative advancement edge check, returns a boolean array that is True for valid transitions.
+        At a configuration, the clearances of the spheres and the lever arm bounds of how far each sphere moves per
+        unit of joint motion certify an interval of the edge around it as collision free. The edge ends are checked
+        first, and then, in bisection order, the middle of every part of an edge no check certified yet, one batch
+        per round for all the edges, until the whole edge is certified or a configuration is closer than
+        advancement_tolerance to a collision.
+        The check is continuous, unlike local_planner it can't step over a thin collision, but it is conservative:
+        edges that pass within advancement_tolerance of a collision are rejected, and near obstacles it takes more
+        configurations than local_planner does. It takes fewer on open edges
+        @param prev_confs - edge start configurations of shape (E, dof)
+        @param current_confs - edge end configurations of shape (E, dof)
+        '''
+        prev_confs, current_confs = np.asarray(prev_confs, dtype=float), np.asarray(current_confs, dtype=float)
+        deltas = current_confs - prev_confs
+        motions = np.abs(deltas)
+        count = len(prev_confs)
+        self.collision_checks += 2 * count
+        collision, steps = self.collision_engine.advancement(
+            self.sphere_coords_batch(np.concatenate([prev_confs, current_confs])), np.concatenate([motions, motions]),
+            np.ones(2 * count), self.advancement_tolerance)
+        valid = ~(collision[:count] | collision[count:])
+        # the parts [low, high] of the edges that aren't certified yet
+        low, high = steps[:count], 1 - steps[count:]
+        edges = np.flatnonzero(valid & (low < high))
+        low, high = low[edges], high[edges]
+        while len(edges):
+            t = (low + high) / 2
+            self.collision_checks += len(edges)
+            collision, steps = self.collision_engine.advancement(
+                self.sphere_coords_batch(prev_confs[edges] + t[:, None] * deltas[edges]), motions[edges],
+                (high - low) / 2, self.advancement_tolerance)
+            valid[edges[collision]] = False
+            left = valid[edges] & (t - steps > low)
+            right = valid[edges] & (t + steps < high)
+            edges, low, high = (np.concatenate([edges[left], edges[right]]),
+                                np.concatenate([low[left], (t + steps)[right]]),
+                                np.concatenate([(t - steps)[left], high[right]]))
+        return valid
+
+    def fingerprint(self) -> str:
+        '''
+        Returns a hash of everything sampling and collision checking depend on: the robot geometry, the obstacles,
+        the workspace limits, the local planner resolution and the cost metric. Used to key data saved to disk
+        '''
+        engine = self.collision_engine
+        parts = [type(self).__name__, self.resolution, self.conservative_advancement, self.advancement_tolerance, engine.x_limit, engine.y_limit, engine.env is not None,
+                 self.env.obstacle_model, self.env.radius, sorted(engine.self_link_pairs)]
+        arrays = [self.cost_weights, self.transform.local_sphere_array, self.transform.sphere_frame_idx,
+                  self.transform.cos_alpha, self.transform.sin_alpha, self.transform.dh_a, self.transform.dh_d,
+                  self.transform.theta_const, engine.radii, self.env.obstacles]
+        for primitive in self.env.primitives:
+            parts.append(type(primitive).__name__)
+            arrays += [np.array(value, dtype=float) for _, value in sorted(vars(primitive).items())]
+        digest = hashlib.sha1(repr(parts).encode())
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
 
     def edge_cost(self, conf1, conf2):
         '''
@@ -107,80 +246,48 @@ class Building_Blocks_UR5e(Building_Blocks):
 
 
 class Building_Blocks_UR3e(Building_Blocks):
-    def sample(self, goal_conf) -> np.array:
-        if random.random() < self.p_bias:
-            return np.array(goal_conf)
-        else:
-            joint_4_direction = 1 # 1 for positive, -1 for negative, has to be constant for the path
-            config = (np.random.uniform(-np.pi, np.pi), np.random.uniform(-np.pi, np.pi), np.random.uniform(-np.pi, np.pi))
-            conf = config_autocomplete(config, joint_4_direction)
-            return np.array(conf)
+    x_limit = UR3E_X_LIMIT
+    y_limit = UR3E_Y_LIMIT
+    check_obstacles = False # we don't have obstacles in our environment for simplicity
+    # a BalancedOccupancyGrid of this robot and environment, set per instance. When set, balanced configurations
+    # in FREE or OCCUPIED cells are answered by a lookup, and sampling skips the OCCUPIED cells
+    occupancy_grid = None
+
+    def sample_uniform(self, count=None, low=None, high=None) -> np.array:
+        confs = self.sample_balanced(1 if count is None else count, low, high)
+        if self.occupancy_grid is not None:
+            occupied = np.flatnonzero(self.occupancy_grid.lookup(confs) == self.occupancy_grid.OCCUPIED)
+            while len(occupied):
+                confs[occupied] = self.sample_balanced(len(occupied), low, high)
+                occupied = occupied[self.occupancy_grid.lookup(confs[occupied]) == self.occupancy_grid.OCCUPIED]
+        return confs[0] if count is None else confs
+
+    def sample_balanced(self, count, low=None, high=None) -> np.array:
+        '''
+        Returns count balanced configurations, as a (count, dof) array. See sample_uniform for the bounds
+        '''
+        joint_4_direction = 1 # 1 for positive, -1 for negative, has to be constant for the path
+        low = np.full(3, -np.pi) if low is None else np.maximum(-np.pi, low[:3])
+        high = np.full(3, np.pi) if high is None else np.minimum(np.pi, high[:3])
+        config = (np.random.uniform(low[0], high[0], count), np.random.uniform(low[1], high[1], count), np.random.uniform(low[2], high[2], count))
+        conf = balanced_config_autocomplete(config, joint_4_direction)
+        return np.stack(np.broadcast_arrays(*conf), axis=-1)
+
     def is_in_collision(self, conf) -> bool:
-        """check for collision in given configuration, arm-arm and arm-obstacle
-        return True if in collision
-        @param conf - some configuration
-        """
-        global_sphere_coords = self.transform.conf2sphere_coords(conf)
-        # arm - arm collision
-        for i in range(len(self.ur_params.ur_links) - 2):
-            for j in range(i + 2, len(self.ur_params.ur_links)):
-                spheres = global_sphere_coords[self.ur_params.ur_links[i]]
-                other_spheres = global_sphere_coords[self.ur_params.ur_links[j]]
-                for s in spheres:
-                    for s2 in other_spheres:
-                        if sphere_collision(s[0:3], s2[0:3], self.ur_params.sphere_radius[self.ur_params.ur_links[i]],
-                        self.ur_params.sphere_radius[self.ur_params.ur_links[j]]):
-                            return True
-        # arm - obstacle collision <Currently we don't have obstacles in our environment for simpliicity>
-        # for joint, spheres in global_sphere_coords.items():
-        #     for sphere in spheres:
-        #         for obstacle in self.env.obstacles:
-        #             if sphere_collision(sphere[0:3], obstacle, self.ur_params.sphere_radius[joint], self.env.radius):
-        #                 return True
-
-        # arm - floor collision
-        for joint, spheres in global_sphere_coords.items():
-            if joint == self.ur_params.ur_links[0]:
-                continue
-            for sphere in spheres:
-                if sphere[2] < self.ur_params.sphere_radius[joint]:
-                    return True
-        # y - axis limit
-        for joint, spheres in global_sphere_coords.items():
-            for sphere in spheres:
-                if sphere[1] + self.ur_params.sphere_radius[joint] > 0.5: # could be slightly buggy
-                    return True
-
-        # x - axis limit
-        for joint, spheres in global_sphere_coords.items():
-            for sphere in spheres:
-                if sphere[0] + self.ur_params.sphere_radius[joint] > 0.4: # could be slightly buggy
-                    return True
-
-        # plate - arm collision
-
-
-        # wrist3_spheres = global_sphere_coords[self.ur_params.ur_links[5]]
-        # plate_center = np.array([0.0, 0.0, 0.0])  # center of the plate
-        # plate_radius = 0.297  # radius of the plate (A4 size)
-
-        # # Add spheres around the plate
-        # plate_spheres = []
-        # for theta in np.linspace(0, 2 * np.pi, num=20):
-        #     x = plate_center[0] + plate_radius * np.cos(theta)
-        #     y = plate_center[1] + plate_radius * np.sin(theta)
-        #     z = plate_center[2]
-        #     plate_spheres.append([x, y, z, 0.0])  # 0.0 is the radius of the sphere
-
-        # # Add the plate spheres to the wrist3_spheres list
-        # wrist3_spheres.extend(plate_spheres)
-
-        # for sphere in wrist3_spheres:
-        #     if sphere_collision(sphere[0:3], plate_center, self.ur_params.sphere_radius[joint], plate_radius):
-        #         return True
-
-        # # plate - floor collision
-        # if plate_center[2] - plate_radius < 0.0:
-        #     return True
-        return False
+        if self.occupancy_grid is not None:
+            state = self.occupancy_grid.lookup(np.asarray(conf, dtype=float)[None])[0]
+            if state != self.occupancy_grid.MIXED:
+                self.grid_lookups += 1
+                return bool(state == self.occupancy_grid.OCCUPIED)
+        return super().is_in_collision(conf)
 
+    def configs_in_collision(self, confs):
+        if self.occupancy_grid is None or len(confs) == 0:
+            return super().configs_in_collision(confs)
+        confs = np.asarray(confs, dtype=float)
+        states = self.occupancy_grid.lookup(confs)
+        collision = states == self.occupancy_grid.OCCUPIED
+        mixed = np.flatnonzero(states == self.occupancy_grid.MIXED)
+        self.grid_lookups += len(confs) - len(mixed)
+        collision[mixed] = super().configs_in_collision(confs[mixed])
+        return collision
@@ -0,0 +1,299 @@
+import numpy as np
+
+
+class SphereCollisionEngine(object):
+    '''
+    SphereCollisionEngine checks the sphere model of the manipulator for arm-arm, arm-obstacle,
+    arm-floor and workspace limit collisions with a few vectorized squared distance comparisons.
+    All the arm spheres are kept in a single (S, 3) array, ordered by link as in Transform.
+    A broad phase bounds every link with an axis aligned box, and sphere level tests only run for
+    link-link pairs whose boxes overlap. Link pairs that can never collide within the mechanical limits
+    (ur_params.link_pair_min_distance) are never checked. Obstacles are queried through the Environment,
+    either its KD-tree of obstacle spheres or its analytic primitives. When the Environment has distance fields
+    enabled and there are obstacles to check, the workspace limits and obstacles are looked up in one instead,
+    and only the spheres the field can't decide are checked exactly, which gives the same result.
+    @param transform - the Transform of the manipulator, defines the spheres
+    @param ur_params - the robot parameters, defines the links and sphere radii
+    @param env - the Environment holding the obstacle spheres
+    @param x_limit - sphere surfaces may not pass this x coordinate, None to disable
+    @param y_limit - sphere surfaces may not pass this y coordinate, None to disable
+    @param check_obstacles - whether to check the arm against env.obstacles
+    '''
+    def __init__(self, transform, ur_params, env, x_limit=None, y_limit=None, check_obstacles=True):
+        self.links = list(ur_params.ur_links)
+        sphere_links = []
+        for link_idx, link in enumerate(self.links):
+            sphere_links += [link_idx] * len(transform.local_sphere_coords[link])
+        self.sphere_links = np.array(sphere_links, dtype=int)
+        self.link_starts = np.searchsorted(self.sphere_links, np.arange(len(self.links)))
+        self.link_ends = np.append(self.link_starts[1:], len(self.sphere_links))
+        self.radii = np.array([ur_params.sphere_radius[self.links[l]] for l in self.sphere_links], dtype=float)
+        self.x_limit = x_limit
+        self.y_limit = y_limit
+
+        # the floor doesn't apply to the first link, it stands on it
+        self.floor_mask = self.sphere_links != 0
+
+        # squared radius sums of the sphere pairs that belong to links at least two apart, 0 for pairs that
+        # are never checked (adjacent links always touch), so d^2 < limit is false for them
+        link_gap = self.sphere_links[None, :] - self.sphere_links[:, None]
+        radius_sums = self.radii[:, None] + self.radii[None, :]
+        self.self_collision_limits = np.where(link_gap >= 2, radius_sums ** 2, 0.0)
+
+        # link pairs that need checking, minus the ones that can never collide
+        min_distances = getattr(ur_params, 'link_pair_min_distance', dict())
+        self.self_link_pairs = []
+        for i in range(len(self.links) - 2):
+            for j in range(i + 2, len(self.links)):
+                radius_sum = ur_params.sphere_radius[self.links[i]] + ur_params.sphere_radius[self.links[j]]
+                if min_distances.get((self.links[i], self.links[j]), -np.inf) > radius_sum:
+                    self.self_collision_limits[self.link_starts[i]:self.link_ends[i], self.link_starts[j]:self.link_ends[j]] = 0
+                else:
+                    self.self_link_pairs.append((i, j))
+        # the checked sphere pairs, for clearance
+        self.pair_a, self.pair_b = np.nonzero(self.self_collision_limits)
+        self.pair_radius_sums = radius_sums[self.pair_a, self.pair_b]
+        # lever arm bounds of the spheres, and of the checked sphere pairs: the joints up to the link of the
+        # first sphere move both spheres rigidly, so only the joints after it change their distance
+        self.lever_arms = sphere_lever_arms(transform)
+        joints = np.arange(self.lever_arms.shape[1])
+        self.pair_lever_arms = np.where(joints[None, :] > self.sphere_links[self.pair_a][:, None],
+                                        self.lever_arms[self.pair_b], 0.0)
+
+        self.env = env if check_obstacles and env.has_obstacles else None
+        # without obstacles the analytic floor and limits checks are cheaper than a field lookup
+        self.distance_field = None if self.env is None else env.distance_field(x_limit, y_limit)
+
+    def sphere_array(self, global_sphere_coords):
+        '''
+        Returns the (S, 3) array of sphere centres from the dict returned by Transform.conf2sphere_coords
+        @param global_sphere_coords - the global sphere coordinates, per link
+        '''
+        return np.array([sphere[:3] for link in self.links for sphere in global_sphere_coords[link]], dtype=float)
+
+    def in_collision(self, spheres):
+        '''
+        Returns True for sphere sets that are in collision
+        @param spheres - sphere centres of shape (S, 3), or (..., S, 3) for a batch of configurations
+        '''
+        spheres = np.asarray(spheres, dtype=float)
+        if self.distance_field is not None:
+            collision = self.field_collision(spheres)
+        else:
+            collision = self.limits_collision(spheres)
+            if self.env is not None:
+                collision |= self.obstacle_collision(spheres)
+        collision |= self.self_collision(spheres)
+        return collision
+
+    def link_bounds(self, spheres):
+        '''
+        Returns the lower and upper corners of the axis aligned box of every link, each of shape (B, L, 3)
+        @param spheres - sphere centres of shape (B, S, 3)
+        '''
+        radii = self.radii[:, None]
+        low = np.minimum.reduceat(spheres - radii, self.link_starts, axis=1)
+        high = np.maximum.reduceat(spheres + radii, self.link_starts, axis=1)
+        return low, high
+
+    def limits_collision(self, spheres):
+        '''
+        Floor and workspace limits check, see in_collision
+        '''
+        collision = np.any(spheres[..., self.floor_mask, 2] < self.radii[self.floor_mask], axis=-1)
+        if self.x_limit is not None:
+            collision |= np.any(spheres[..., 0] + self.radii > self.x_limit, axis=-1)
+        if self.y_limit is not None:
+            collision |= np.any(spheres[..., 1] + self.radii > self.y_limit, axis=-1)
+        return collision
+
+    def self_collision(self, spheres):
+        '''
+        Arm - arm check, see in_collision
+        '''
+        batch_shape = spheres.shape[:-2]
+        spheres = spheres.reshape((-1,) + spheres.shape[-2:])
+        low, high = self.link_bounds(spheres)
+        collision = np.zeros(len(spheres), dtype=bool)
+        for i, j in self.self_link_pairs:
+            overlap = np.all((low[:, i] <= high[:, j]) & (low[:, j] <= high[:, i]), axis=-1)
+            rows = np.flatnonzero(overlap & ~collision)
+            if len(rows) == 0:
+                continue
+            spheres_i = spheres[rows, self.link_starts[i]:self.link_ends[i]]
+            spheres_j = spheres[rows, self.link_starts[j]:self.link_ends[j]]
+            diff = spheres_i[:, :, None, :] - spheres_j[:, None, :, :]
+            dist2 = np.einsum('...k,...k->...', diff, diff)
+            limits = self.self_collision_limits[self.link_starts[i]:self.link_ends[i], self.link_starts[j]:self.link_ends[j]]
+            collision[rows] = np.any(dist2 < limits, axis=(-2, -1))
+        return collision.reshape(batch_shape)
+
+    def obstacle_collision(self, spheres):
+        '''
+        Arm - obstacle check, see in_collision
+        '''
+        return np.any(self.env.spheres_in_collision(spheres, self.radii), axis=-1)
+
+    def field_collision(self, spheres):
+        '''
+        Floor, workspace limits and arm - obstacle check through the distance field, see in_collision.
+        The field leaves the floor out, so the first link, which the floor doesn't apply to, is looked up like
+        the others, and the floor is checked exactly on the other spheres. Only the spheres the field can't
+        decide, of configurations not already known to collide, are checked exactly with sphere_collisions
+        '''
+        batch_shape = spheres.shape[:-2]
+        spheres = spheres.reshape((-1,) + spheres.shape[-2:])
+        collision, uncertain = self.distance_field.classify(spheres, self.radii)
+        configs_collision = (np.any(collision, axis=-1) |
+                             np.any(spheres[:, self.floor_mask, 2] < self.radii[self.floor_mask], axis=-1))
+        rows, cols = np.nonzero(uncertain & ~configs_collision[:, None])
+        if len(rows):
+            exact = self.sphere_collisions(spheres[rows, cols], self.radii[cols], floor=False)
+            configs_collision[rows[exact]] = True
+        return configs_collision.reshape(batch_shape)
+
+    def sphere_collisions(self, centres, radii, floor):
+        '''
+        Exact floor, workspace limits and obstacle check of individual spheres, returns True for every sphere in
+        collision
+        @param centres - sphere centres of shape (N, 3)
+        @param radii - sphere radii of shape (N,)
+        @param floor - whether to check the floor
+        '''
+        collision = centres[:, 2] < radii if floor else np.zeros(len(centres), dtype=bool)
+        if self.x_limit is not None:
+            collision |= centres[:, 0] + radii > self.x_limit
+        if self.y_limit is not None:
+            collision |= centres[:, 1] + radii > self.y_limit
+        if self.env is not None and len(centres):
+            collision |= self.env.spheres_in_collision(centres, radii)
+        return collision
+
+    def clearance(self, spheres):
+        '''
+        Returns the clearance of every sphere to the floor, the workspace limits and the obstacles, of shape (..., S),
+        and the distance between the surfaces of every checked self collision sphere pair, of shape (..., P).
+        in_collision is True where any of them is negative
+        @param spheres - sphere centres of shape (..., S, 3)
+        '''
+        spheres = np.asarray(spheres, dtype=float)
+        clearance = self.sphere_clearance(spheres)
+        diff = spheres[..., self.pair_a, :] - spheres[..., self.pair_b, :]
+        pair_clearance = np.sqrt(np.einsum('...k,...k->...', diff, diff)) - self.pair_radius_sums
+        return clearance, pair_clearance
+
+    def sphere_clearance(self, spheres, max_distance=np.inf):
+        '''
+        Returns the clearance of every sphere to the floor, the workspace limits and the obstacles, of shape (..., S).
+        Obstacle clearances above max_distance may be returned as inf
+        @param spheres - sphere centres of shape (..., S, 3)
+        @param max_distance - the largest obstacle clearance needed
+        '''
+        clearance = np.where(self.floor_mask, spheres[..., 2] - self.radii, np.inf)
+        if self.x_limit is not None:
+            clearance = np.minimum(clearance, self.x_limit - spheres[..., 0] - self.radii)
+        if self.y_limit is not None:
+            clearance = np.minimum(clearance, self.y_limit - spheres[..., 1] - self.radii)
+        if self.env is not None:
+            clearance = np.minimum(clearance, self.env.sphere_clearances(spheres, self.radii, max_distance))
+        return clearance
+
+    def advancement(self, spheres, joint_motions, reach, tolerance):
+        '''
+        Conservative advancement step. Returns which sphere sets are closer than tolerance to a collision, and how
+        far along a joint space motion, in either direction, each one can move with no collision possible: no
+        sphere can move further than its clearance, and no checked pair of spheres can move closer than the
+        distance between their surfaces. Obstacles are only searched as far as reach needs, further ones can't
+        limit the step below reach
+        @param spheres - sphere centres of shape (B, S, 3)
+        @param joint_motions - absolute joint differences per unit of motion, of shape (B, joints)
+        @param reach - the step needed for each sphere set, of shape (B,)
+        @param tolerance - the clearance below which a sphere set counts as colliding
+        '''
+        speeds = joint_motions @ self.lever_arms.T
+        pair_speeds = joint_motions @ self.pair_lever_arms.T
+        clearance = self.sphere_clearance(spheres, np.max(speeds * reach[:, None], initial=0.0) + tolerance)
+        diff = spheres[:, self.pair_a] - spheres[:, self.pair_b]
+        pair_clearance = np.sqrt(np.einsum('...k,...k->...', diff, diff)) - self.pair_radius_sums
+        collision = np.any(clearance < tolerance, axis=-1) | np.any(pair_clearance < tolerance, axis=-1)
+        steps = np.minimum(
+            np.min(np.divide(clearance, speeds, out=np.full(clearance.shape, np.inf), where=speeds > 0),
+                   axis=-1, initial=np.inf),
+            np.min(np.divide(pair_clearance, pair_speeds, out=np.full(pair_clearance.shape, np.inf),
+                             where=pair_speeds > 0), axis=-1, initial=np.inf))
+        return collision, steps
+
+
+def sphere_lever_arms(transform):
+    '''
+    Returns the (S, joints) lever arm bounds of the spheres of a Transform: an upper bound, over all configurations,
+    on the distance from every sphere to the axis of every joint, so moving the joints by dq moves sphere s
+    by at most sum_k |dq_k| * lever_arms[s, k]. Joint k rotates about an axis through the origin of link frame k,
+    so the bound is the sphere offset in its link frame plus the translations of the links between joint k and
+    the sphere. It is zero for the joints after the link of the sphere, which don't move it
+    @param transform - the Transform of the manipulator
+    '''
+    cumulative_lengths = np.cumsum(np.hypot(transform.dh_a, transform.dh_d))
+    frames = transform.sphere_frame_idx
+    lever_arms = (np.linalg.norm(transform.local_sphere_array[:, :3], axis=1)[:, None] +
+                  cumulative_lengths[frames][:, None] - cumulative_lengths[None, :])
+    return np.where(np.arange(len(cumulative_lengths))[None, :] <= frames[:, None], lever_arms, 0.0)
+
+
+def compute_link_pair_min_distances(ur_params, grid_points=32, max_grid_size=2000000, batch_size=20000):
+    '''
+    Offline computation of a certified lower bound on the centre distance between the spheres of every
+    pair of links at least two apart, over the mechanical_limits of the joints between them.
+    The relative pose of link j in the frame of link i only depends on joints i+1..j, so these joints are
+    sampled on a grid of cell centres, and the distance found at each grid point is reduced by how far a
+    sphere can move within the cell (half a grid step times the largest lever arm of each joint).
+    Link pairs whose bound is above the sum of their sphere radii can never collide.
+    Used to generate LINK_PAIR_MIN_DISTANCES in UR_Params, returns a dict {(link_i, link_j): bound}
+    @param ur_params - the robot parameters
+    @param grid_points - grid points per joint, reduced for long chains so the grid stays below max_grid_size
+    '''
+    from .UR_Params import Transform
+    transform = Transform(ur_params)
+    links = list(ur_params.ur_links)
+    dh = np.array(ur_params.ur_DH, dtype=float)
+    translation_lengths = np.hypot(dh[:, 1], dh[:, 2])
+    bounds = dict()
+    for i in range(len(links) - 2):
+        local_i = np.array(transform.local_sphere_coords[links[i]], dtype=float)[:, :3]
+        for j in range(i + 2, len(links)):
+            local_j = np.array(transform.local_sphere_coords[links[j]], dtype=float)
+            joints = np.arange(i + 1, j + 1)
+            points = min(grid_points, int(max_grid_size ** (1 / len(joints))))
+            limits = np.array([ur_params.mechanical_limits[links[k]] for k in joints], dtype=float)
+            steps = (limits[:, 1] - limits[:, 0]) / points
+            axes = [low + step * (np.arange(points) + 0.5) for (low, _), step in zip(limits, steps)]
+
+            # lever arm bound of joint k for each sphere of link j: |sphere| plus the translations after joint k
+            norms = np.linalg.norm(local_j[:, :3], axis=1)
+            margins = np.zeros(len(local_j))
+            for n, k in enumerate(joints):
+                margins += steps[n] / 2 * (norms + translation_lengths[k + 1:j + 1].sum())
+
+            best = np.inf
+            grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(joints))
+            for start in range(0, len(grid), batch_size):
+                theta = grid[start:start + batch_size] + dh[joints, 3]
+                rel = np.broadcast_to(np.eye(4), (len(theta), 4, 4))
+                for n, k in enumerate(joints):
+                    rel = np.matmul(rel, _dh_matrices(dh[k], theta[:, n]))
+                spheres_j = np.einsum('bij,sj->bsi', rel[:, :3, :], local_j)
+                dists = np.linalg.norm(spheres_j[:, None, :, :] - local_i[None, :, None, :], axis=-1)
+                best = min(best, np.min(dists - margins))
+            bounds[(links[i], links[j])] = float(best)
+    return bounds
+
+
+def _dh_matrices(dh_row, theta):
+    alpha, a, d, _ = dh_row
+    cos_theta, sin_theta, cos_alpha, sin_alpha = np.cos(theta), np.sin(theta), np.cos(alpha), np.sin(alpha)
+    trans = np.zeros((len(theta), 4, 4))
+    trans[:, 0, 0], trans[:, 0, 1], trans[:, 0, 3] = cos_theta, -sin_theta, a
+    trans[:, 1, 0], trans[:, 1, 1], trans[:, 1, 2], trans[:, 1, 3] = sin_theta * cos_alpha, cos_theta * cos_alpha, -sin_alpha, -d * sin_alpha
+    trans[:, 2, 0], trans[:, 2, 1], trans[:, 2, 2], trans[:, 2, 3] = sin_theta * sin_alpha, cos_theta * sin_alpha, cos_alpha, d * cos_alpha
+    trans[:, 3, 3] = 1
+    return trans
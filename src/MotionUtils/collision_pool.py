@@ -0,0 +1,150 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+
+# per worker process state, set once by _init_worker
+_worker = dict()
+
+
+def _init_worker(bb, confs_name, results_name, capacity, dof, first_collision):
+    confs_shm = shared_memory.SharedMemory(name=confs_name)
+    results_shm = shared_memory.SharedMemory(name=results_name)
+    _worker['bb'] = bb
+    _worker['shm'] = (confs_shm, results_shm)
+    _worker['confs'] = np.ndarray((capacity, dof), dtype=float, buffer=confs_shm.buf)
+    _worker['results'] = np.ndarray((capacity,), dtype=bool, buffer=results_shm.buf)
+    _worker['first_collision'] = first_collision
+
+
+def _check_chunk(start, stop):
+    _worker['results'][start:stop] = _worker['bb'].configs_in_collision(_worker['confs'][start:stop])
+
+
+def _first_collision_chunk(start, stop):
+    first_collision = _worker['first_collision']
+    if first_collision.value < start: # an earlier chunk already collides
+        return
+    collisions = np.flatnonzero(_worker['bb'].configs_in_collision(_worker['confs'][start:stop]))
+    if len(collisions):
+        with first_collision.get_lock():
+            first_collision.value = min(first_collision.value, start + int(collisions[0]))
+
+
+class CollisionPool(object):
+    '''
+    CollisionPool checks large batches of configurations for collision on a process pool.
+    Every worker loads the building blocks (robot geometry and environment) once, and configurations and
+    results are passed through shared memory arrays, so a batch is split between the workers by index
+    ranges only. Batches larger than the shared arrays are processed in consecutive blocks.
+    Use it as a context manager, or call close, to release the workers and the shared memory.
+    @param bb - building blocks of the robot
+    @param num_workers - number of worker processes, defaults to the number of cores
+    @param capacity - number of configurations in the shared arrays
+    @param chunk_size - number of configurations a worker checks per task, defaults to splitting each block
+                        in 4 tasks per worker
+    '''
+    def __init__(self, bb, num_workers=None, capacity=100000, chunk_size=None):
+        self.bb = bb
+        self.num_workers = os.cpu_count() if num_workers is None else num_workers
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        dof = len(bb.cost_weights)
+        self.confs_shm = shared_memory.SharedMemory(create=True, size=capacity * dof * np.dtype(float).itemsize)
+        self.results_shm = shared_memory.SharedMemory(create=True, size=capacity * np.dtype(bool).itemsize)
+        self.confs = np.ndarray((capacity, dof), dtype=float, buffer=self.confs_shm.buf)
+        self.results = np.ndarray((capacity,), dtype=bool, buffer=self.results_shm.buf)
+        self.first_collision = multiprocessing.Value('q', capacity)
+        self.pool = ProcessPoolExecutor(self.num_workers, initializer=_init_worker,
+                                        initargs=(bb, self.confs_shm.name, self.results_shm.name, capacity, dof,
+                                                  self.first_collision))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''
+        Shuts the workers down and releases the shared memory
+        '''
+        if self.pool is None:
+            return
+        self.pool.shutdown()
+        self.pool = None
+        del self.confs, self.results
+        for shm in (self.confs_shm, self.results_shm):
+            shm.close()
+            shm.unlink()
+
+    def _chunks(self, size):
+        chunk_size = self.chunk_size or max(1, -(-size // (4 * self.num_workers)))
+        return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+    def _run(self, task, size):
+        '''
+        Runs task over the chunks of the first size shared configurations and waits for all of them.
+        Raises the first worker exception, so a failed chunk is never read as a result
+        '''
+        futures = [self.pool.submit(task, start, stop) for start, stop in self._chunks(size)]
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def in_collision(self, confs):
+        '''
+        Batched is_in_collision, returns a boolean array that is True for configurations in collision
+        @param confs - configurations of shape (B, dof)
+        '''
+        confs = np.asarray(confs, dtype=float)
+        collisions = np.zeros(len(confs), dtype=bool)
+        for offset in range(0, len(confs), self.capacity):
+            block = confs[offset:offset + self.capacity]
+            self.confs[:len(block)] = block
+            self.results[:len(block)] = False
+            self._run(_check_chunk, len(block))
+            collisions[offset:offset + len(block)] = self.results[:len(block)]
+        return collisions
+
+    def first_collision_index(self, confs):
+        '''
+        Returns the index of the first configuration in collision, -1 if there is none.
+        Chunks after a chunk that is known to collide are skipped
+        @param confs - configurations of shape (B, dof)
+        '''
+        confs = np.asarray(confs, dtype=float)
+        for offset in range(0, len(confs), self.capacity):
+            block = confs[offset:offset + self.capacity]
+            self.confs[:len(block)] = block
+            self.first_collision.value = self.capacity
+            self._run(_first_collision_chunk, len(block))
+            if self.first_collision.value < len(block):
+                return offset + self.first_collision.value
+        return -1
+
+    def edges_valid(self, prev_confs, current_confs):
+        '''
+        Batched local_planner over many edges, returns a boolean array that is True for valid transitions
+        @param prev_confs - edge start configurations of shape (E, dof)
+        @param current_confs - edge end configurations of shape (E, dof)
+        '''
+        edges = [self.bb.edge_configurations(prev, current) for prev, current in
+                 zip(np.asarray(prev_confs, dtype=float), np.asarray(current_confs, dtype=float))]
+        if len(edges) == 0:
+            return np.zeros(0, dtype=bool)
+        collisions = self.in_collision(np.concatenate(edges))
+        starts = np.cumsum([0] + [len(confs) for confs in edges[:-1]])
+        return ~np.logical_or.reduceat(collisions, starts)
+
+    def path_valid(self, plan):
+        '''
+        Returns whether a plan is collision free, with every edge interpolated as in local_planner
+        @param plan - the configurations of the plan, of shape (N, dof)
+        '''
+        plan = np.asarray(plan, dtype=float)
+        if len(plan) < 2:
+            return not np.any(self.in_collision(plan))
+        confs = np.concatenate([self.bb.edge_configurations(prev, current) for prev, current in zip(plan, plan[1:])])
+        return self.first_collision_index(confs) < 0
@@ -0,0 +1,134 @@
+import os
+import itertools
+import numpy as np
+
+# the 8 corners of a grid cell, as index offsets
+CELL_CORNERS = np.array(list(itertools.product((0, 1), repeat=3)), dtype=int)
+
+
+class SignedDistanceField(object):
+    '''
+    SignedDistanceField samples a signed distance function on a regular 3D voxel grid, and looks it up with
+    vectorized trilinear interpolation, so a query costs the same no matter what the function is made of.
+    For a 1-Lipschitz function (a true distance) the interpolated distance is within margin = resolution * sqrt(3) / 2
+    of the exact one, and so is the value at the nearest grid point, which classify uses to tell the spheres that
+    are certainly free or certainly in collision from the ones that have to be checked exactly.
+    @param grid - the function at the grid points, of shape (nx, ny, nz)
+    @param origin - the coordinates of grid point (0, 0, 0)
+    @param resolution - the grid spacing
+    '''
+    def __init__(self, grid, origin, resolution):
+        self.grid = grid
+        self.origin = np.asarray(origin, dtype=float)
+        self.resolution = resolution
+        self.shape = np.array(grid.shape)
+        self.margin = resolution * np.sqrt(3) / 2
+        # lookups gather from the flat grid, at the flat index of a cell plus the offsets of its corners
+        self.values = grid.reshape(-1)
+        self.strides = np.array([grid.shape[1] * grid.shape[2], grid.shape[2], 1])
+        self.corner_offsets = CELL_CORNERS @ self.strides
+
+    @classmethod
+    def build(cls, distance_function, low, high, resolution, batch_size=200000):
+        '''
+        Samples distance_function on a grid covering the box low - high
+        @param distance_function - maps points of shape (N, 3) to their signed distances
+        @param low - the lower corner of the box
+        @param high - the upper corner of the box, rounded up to a whole number of cells
+        @param batch_size - number of grid points passed to distance_function at once
+        '''
+        low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+        shape = np.ceil((high - low) / resolution).astype(int) + 1
+        axes = [low[axis] + resolution * np.arange(shape[axis]) for axis in range(3)]
+        points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        grid = np.concatenate([distance_function(points[start:start + batch_size])
+                               for start in range(0, len(points), batch_size)])
+        return cls(grid.reshape(shape), low, resolution)
+
+    @classmethod
+    def load_or_build(cls, distance_function, low, high, resolution, directory, key):
+        '''
+        Loads the grid saved under directory with key, building and saving it first if there is none.
+        The key has to identify the distance function, the box and the resolution, see build
+        @param directory - the directory holding the saved grids
+        @param key - the file name of the grid
+        '''
+        path = os.path.join(directory, key + '.npy')
+        if os.path.exists(path):
+            return cls(np.load(path), low, resolution)
+        field = cls.build(distance_function, low, high, resolution)
+        os.makedirs(directory, exist_ok=True)
+        np.save(path, field.grid)
+        return field
+
+    def cells(self, points):
+        '''
+        Returns the cell index and the position inside the cell, in [0, 1], of every point, of shape (N, 3) each,
+        and whether the point is inside the grid
+        @param points - points of shape (N, 3)
+        '''
+        coords = (np.asarray(points, dtype=float) - self.origin) / self.resolution
+        inside = np.all((coords >= 0) & (coords <= self.shape - 1), axis=-1)
+        # np.clip is slow on small arrays, and lookups are mostly single configurations
+        idx = np.minimum(np.maximum(np.floor(coords).astype(int), 0), self.shape - 2)
+        return idx, np.minimum(np.maximum(coords - idx, 0), 1), inside
+
+    def corner_values(self, idx):
+        '''
+        Returns the grid values at the 8 corners of every cell, of shape (8, N), in CELL_CORNERS order
+        '''
+        return self.values[idx @ self.strides + self.corner_offsets[:, None]]
+
+    def distances(self, points):
+        '''
+        Returns the interpolated distance at points of shape (..., 3), and whether they are inside the grid.
+        Points outside the grid get the value of the nearest boundary cell
+        '''
+        points = np.asarray(points, dtype=float)
+        idx, frac, inside = self.cells(points.reshape(-1, 3))
+        values = self.corner_values(idx)
+        # interpolate along x, then y, then z
+        values = values[:4] + frac[:, 0] * (values[4:] - values[:4])
+        values = values[:2] + frac[:, 1] * (values[2:] - values[:2])
+        dists = values[0] + frac[:, 2] * (values[1] - values[0])
+        return dists.reshape(points.shape[:-1]), inside.reshape(points.shape[:-1])
+
+    def gradients(self, points):
+        '''
+        Returns the gradient of the interpolated distance at points of shape (..., 3), of shape (..., 3)
+        '''
+        points = np.asarray(points, dtype=float)
+        idx, frac, _ = self.cells(points.reshape(-1, 3))
+        axis_weights = np.where(CELL_CORNERS[:, None, :], frac, 1 - frac)
+        values = self.corner_values(idx)
+        gradients = np.empty((len(frac), 3))
+        for axis in range(3):
+            others = np.prod(np.delete(axis_weights, axis, axis=-1), axis=-1)
+            gradients[:, axis] = np.sum((2 * CELL_CORNERS[:, axis, None] - 1) * others * values, axis=0)
+        return (gradients / self.resolution).reshape(points.shape)
+
+    def nearest_values(self, points):
+        '''
+        Returns the grid value at the grid point nearest to points of shape (..., 3), and whether they are inside
+        the grid. The nearest grid point is at most margin away, so for a 1-Lipschitz function this is within
+        margin of the exact value as well, at the cost of one gather instead of eight
+        '''
+        points = np.asarray(points, dtype=float)
+        coords = (points.reshape(-1, 3) - self.origin) / self.resolution
+        inside = np.all((coords >= 0) & (coords <= self.shape - 1), axis=-1)
+        idx = np.minimum(np.maximum(np.rint(coords).astype(int), 0), self.shape - 1)
+        return self.values[idx @ self.strides].reshape(points.shape[:-1]), inside.reshape(points.shape[:-1])
+
+    def classify(self, centres, radii):
+        '''
+        Returns which spheres are certainly in collision (closer to the surface than their radius) and which
+        ones the field can't decide, because they are outside the grid or within margin of touching the surface.
+        Both only depend on margin, so the spheres are looked up with nearest_values rather than interpolated
+        @param centres - sphere centres of shape (..., S, 3)
+        @param radii - sphere radii of shape (S,)
+        '''
+        dists, inside = self.nearest_values(centres)
+        clearances = dists - radii
+        collision = inside & (clearances < -self.margin)
+        uncertain = ~inside | (np.abs(clearances) <= self.margin)
+        return collision, uncertain
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+
+class EdgeValidityCache(object):
+    '''
+    Bounded LRU cache of edge validity results, keyed by the unordered pair of tree vertex ids.
+    Counts hits and misses, so planners can report how many edge checks were saved.
+    @param max_size - maximal number of cached edges, the least recently used is evicted first
+    '''
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(a, b):
+        a, b = int(a), int(b)
+        return (a, b) if a < b else (b, a)
+
+    def get(self, a, b):
+        '''
+        Returns the cached validity of the edge between vertices a and b, None if it is not cached
+        '''
+        key = self.key(a, b)
+        valid = self.entries.get(key)
+        if valid is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return valid
+
+    def peek(self, a, b):
+        '''
+        Like get, without counting a hit or a miss or refreshing the entry
+        '''
+        return self.entries.get(self.key(a, b))
+
+    def put(self, a, b, valid):
+        '''
+        Caches the validity of the edge between vertices a and b
+        '''
+        key = self.key(a, b)
+        self.entries[key] = bool(valid)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def remap(self, new_ids):
+        '''
+        Renames the vertex ids of the cached edges after the tree was compacted, dropping the edges
+        of removed vertices. The recency order is kept
+        @param new_ids - array mapping old vertex ids to new ones, -1 for removed vertices
+        '''
+        entries = OrderedDict()
+        for (a, b), valid in self.entries.items():
+            if a < len(new_ids) and b < len(new_ids) and new_ids[a] >= 0 and new_ids[b] >= 0:
+                entries[self.key(new_ids[a], new_ids[b])] = valid
+        self.entries = entries
@@ -1,12 +1,76 @@
 
+import hashlib
 import numpy as np
+from scipy.spatial import cKDTree
+from .distance_field import SignedDistanceField
+
+
+class OrientedBox(object):
+    '''
+    An oriented box obstacle, inflated by a margin (a box with rounded edges).
+    A wall is a box with a zero half extent along its constant axis.
+    @param center - the box center
+    @param half_extents - half the box size along each of its axes
+    @param rotation - the box axes as the columns of a rotation matrix, axis aligned by default
+    @param margin - distance the box is inflated by
+    '''
+    def __init__(self, center, half_extents, rotation=None, margin=0.0):
+        self.center = np.asarray(center, dtype=float)
+        self.half_extents = np.asarray(half_extents, dtype=float)
+        self.rotation = np.eye(3) if rotation is None else np.asarray(rotation, dtype=float)
+        self.margin = margin
+
+    def signed_distance(self, points):
+        '''
+        Returns the signed distance from points of shape (..., 3) to the box surface, negative inside
+        '''
+        local = np.abs((np.asarray(points, dtype=float) - self.center) @ self.rotation) - self.half_extents
+        outside = np.linalg.norm(np.maximum(local, 0), axis=-1)
+        inside = np.minimum(np.max(local, axis=-1), 0)
+        return outside + inside - self.margin
+
+
+class HalfSpace(object):
+    '''
+    A half space obstacle, all the points p with dot(normal, p) > offset
+    @param normal - unit normal pointing into the obstacle
+    @param offset - the plane offset along the normal
+    '''
+    def __init__(self, normal, offset):
+        self.normal = np.asarray(normal, dtype=float) / np.linalg.norm(normal)
+        self.offset = offset
+
+    def signed_distance(self, points):
+        '''
+        Returns the signed distance from points of shape (..., 3) to the half space, negative inside
+        '''
+        return self.offset - np.asarray(points, dtype=float) @ self.normal
+
 
 class Environment(object):
     '''
-    Environment class implements the physical robot's environment
+    Environment class implements the physical robot's environment.
+    Every wall and box is kept both as a cloud of spheres (self.obstacles, indexed by a KD-tree so
+    proximity queries only touch nearby obstacles) and as an analytic primitive (self.primitives).
+    With sdf_resolution set, the obstacles and the workspace limits are also baked into signed distance
+    fields (see distance_field), which the collision engine looks the arm spheres up in.
+    @param env_idx - the scene
+    @param obstacle_model - 'spheres' checks against the sphere cloud, 'primitives' against the exact walls
+    @param sdf_resolution - the voxel size of the distance fields, None to not use them
+    @param sdf_bounds - the lower and upper corners of the box the distance fields cover, around the robot base
+    @param sdf_cache - the directory distance fields are saved in, None to build them every time
     '''
-    def __init__(self, env_idx):
+    def __init__(self, env_idx, obstacle_model='spheres', sdf_resolution=None,
+                 sdf_bounds=((-1.1, -1.1, -0.2), (1.1, 1.1, 1.3)), sdf_cache=None):
+        if obstacle_model not in ('spheres', 'primitives'):
+            raise ValueError("obstacle_model must be 'spheres' or 'primitives'")
+        self.obstacle_model = obstacle_model
+        self.sdf_resolution = sdf_resolution
+        self.sdf_bounds = sdf_bounds
+        self.sdf_cache = sdf_cache
+        self.distance_fields = dict()
         self.radius = 0.05
+        self.primitives = []
         obstacles = []
         # env_idx = 0 is obstacle free
         if env_idx == 1:
@@ -25,6 +89,119 @@ class Environment(object):
             self.box(x=0, y=-0.6, dx=0.3, dy=0.15, dz=0.15, obstacles=obstacles, skip=['-y'])
 
         self.obstacles = np.array(obstacles)
+        self.obstacles_tree = cKDTree(self.obstacles) if len(self.obstacles) > 0 else None
+
+    @property
+    def has_obstacles(self):
+        '''
+        Whether the environment has obstacles in the selected obstacle model
+        '''
+        if self.obstacle_model == 'primitives':
+            return len(self.primitives) > 0
+        return len(self.obstacles) > 0
+
+    def primitive_distances(self, points):
+        '''
+        Returns the signed distance from each point to the nearest primitive surface, inf without primitives
+        @param points - points of shape (..., 3)
+        '''
+        points = np.asarray(points, dtype=float)
+        dists = np.full(points.shape[:-1], np.inf)
+        for primitive in self.primitives:
+            dists = np.minimum(dists, primitive.signed_distance(points))
+        return dists
+
+    def obstacle_distances(self, points, max_distance=np.inf):
+        '''
+        Returns the distance from each point to the nearest obstacle sphere centre,
+        inf where there is none within max_distance
+        @param points - points of shape (..., 3)
+        @param max_distance - the search radius
+        '''
+        points = np.asarray(points, dtype=float)
+        if self.obstacles_tree is None:
+            return np.full(points.shape[:-1], np.inf)
+        dists, _ = self.obstacles_tree.query(points.reshape(-1, 3), k=1, distance_upper_bound=max_distance)
+        return dists.reshape(points.shape[:-1])
+
+    def spheres_in_collision(self, centres, radii):
+        '''
+        Returns True for every sphere that intersects an obstacle
+        @param centres - sphere centres of shape (..., S, 3)
+        @param radii - sphere radii of shape (S,)
+        '''
+        if self.obstacle_model == 'primitives':
+            return self.primitive_distances(centres) < radii
+        dists = self.obstacle_distances(centres, max_distance=np.max(radii) + self.radius)
+        return dists < radii + self.radius
+
+    def sphere_clearances(self, centres, radii, max_distance=np.inf):
+        '''
+        Returns the distance from the surface of every sphere to the nearest obstacle, negative when they intersect
+        @param centres - sphere centres of shape (..., S, 3)
+        @param radii - sphere radii of shape (S,)
+        @param max_distance - obstacle spheres are only searched within this distance, clearances above it
+                              may be returned as inf
+        '''
+        if self.obstacle_model == 'primitives':
+            return self.primitive_distances(centres) - radii
+        return self.obstacle_distances(centres, max_distance + np.max(radii) + self.radius) - radii - self.radius
+
+    def surface_distances(self, points, x_limit=None, y_limit=None, floor=True, obstacles=True):
+        '''
+        Returns the signed distance from each point to the nearest of the obstacle surfaces, the floor (z = 0)
+        and the x / y workspace limits, negative inside them
+        @param points - points of shape (..., 3)
+        @param x_limit - points may not pass this x coordinate, None to disable
+        @param y_limit - points may not pass this y coordinate, None to disable
+        @param floor - whether to include the floor
+        @param obstacles - whether to include the obstacles
+        '''
+        points = np.asarray(points, dtype=float)
+        half_spaces = [HalfSpace(normal, offset) for normal, offset, enabled in
+                       (([0, 0, -1], 0, floor), ([1, 0, 0], x_limit, x_limit is not None),
+                        ([0, 1, 0], y_limit, y_limit is not None)) if enabled]
+        dists = np.full(points.shape[:-1], np.inf)
+        for half_space in half_spaces:
+            dists = np.minimum(dists, half_space.signed_distance(points))
+        if obstacles and self.obstacle_model == 'primitives':
+            dists = np.minimum(dists, self.primitive_distances(points))
+        elif obstacles:
+            dists = np.minimum(dists, self.obstacle_distances(points) - self.radius)
+        return dists
+
+    def distance_field(self, x_limit=None, y_limit=None, obstacles=True):
+        '''
+        Returns the SignedDistanceField of surface_distances without the floor, None when sdf_resolution is None.
+        The floor doesn't apply to every sphere of the arm, and it is a plane, so it is checked exactly instead.
+        Each field is built once, and loaded from sdf_cache when it was saved there
+        '''
+        if self.sdf_resolution is None:
+            return None
+        key = (x_limit, y_limit, obstacles and self.has_obstacles)
+        if key not in self.distance_fields:
+            distance_function = lambda points: self.surface_distances(points, x_limit, y_limit, False, key[2])
+            low, high = self.sdf_bounds
+            if self.sdf_cache is None:
+                field = SignedDistanceField.build(distance_function, low, high, self.sdf_resolution)
+            else:
+                field = SignedDistanceField.load_or_build(distance_function, low, high, self.sdf_resolution,
+                                                          self.sdf_cache, self.distance_field_key(*key))
+            self.distance_fields[key] = field
+        return self.distance_fields[key]
+
+    def distance_field_key(self, x_limit, y_limit, obstacles):
+        '''
+        Returns a hash of everything a distance field depends on, to name its cache file
+        '''
+        parts = [self.obstacle_model, self.radius, x_limit, y_limit, obstacles, 'no floor', self.sdf_resolution,
+                 np.array(self.sdf_bounds, dtype=float).tolist()]
+        if obstacles:
+            parts += [self.obstacles.tolist()]
+            for primitive in self.primitives:
+                parts += [type(primitive).__name__] + [np.array(value, dtype=float).tolist()
+                                                       for _, value in sorted(vars(primitive).items())]
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
 
     def sphere_num(self, min_coord, max_cord):
         '''
@@ -41,6 +218,8 @@ class Environment(object):
         for x in list(np.linspace(x_min, x_max,  num= num_x, endpoint=True)):
                 for z in list(np.linspace(z_min, z_max, num= num_z, endpoint=True)):
                     obstacles.append([x, y_const, z])
+        self.primitives.append(OrientedBox([(x_min + x_max) / 2, y_const, (z_min + z_max) / 2],
+                                           [abs(x_max - x_min) / 2, 0, abs(z_max - z_min) / 2], margin=self.radius))
 
     def wall_x_const(self, y_min, y_max, z_min, z_max, x_const, obstacles):
         '''
@@ -51,6 +230,8 @@ class Environment(object):
         for y in list(np.linspace(y_min, y_max,  num= num_y, endpoint=True)):
                 for z in list(np.linspace(z_min, z_max , num= num_z, endpoint=True)):
                     obstacles.append([x_const, y, z])
+        self.primitives.append(OrientedBox([x_const, (y_min + y_max) / 2, (z_min + z_max) / 2],
+                                           [0, abs(y_max - y_min) / 2, abs(z_max - z_min) / 2], margin=self.radius))
 
     def wall_z_const(self, x_min, x_max, y_min, y_max, z_const, obstacles):
         '''
@@ -61,6 +242,8 @@ class Environment(object):
         for y in list(np.linspace(y_min, y_max,  num= num_y, endpoint=True)):
                 for x in list(np.linspace(x_min, x_max , num= num_x, endpoint=True)):
                     obstacles.append([x, y, z_const])
+        self.primitives.append(OrientedBox([(x_min + x_max) / 2, (y_min + y_max) / 2, z_const],
+                                           [abs(x_max - x_min) / 2, abs(y_max - y_min) / 2, 0], margin=self.radius))
 
     def box(self, x, y, dx, dy, dz, obstacles, skip =[]):
         '''
@@ -0,0 +1,115 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class WeightedNNIndex(object):
+    '''
+    Nearest neighbour index over joint configurations for the weighted metric of
+    Building_Blocks.edge_cost, i.e. sqrt(sum(w * (a - b) ** 2)).
+    Configurations are stored scaled by sqrt(w), which turns the metric into a plain
+    euclidean distance. A KD-tree covers the bulk of the points and the most recently
+    added ones (the "tail") are searched by batched brute force; the KD-tree is rebuilt
+    once the tail grows past a fraction of the indexed points, so insertion stays cheap.
+    @param weights - the per joint weights of the metric
+    @param capacity - initial number of preallocated rows
+    @param rebuild_ratio - rebuild the KD-tree when the tail exceeds this fraction of it
+    @param min_tail - the tail is always allowed to grow up to this size before a rebuild
+    '''
+    def __init__(self, weights, capacity=1024, rebuild_ratio=0.25, min_tail=256, leaf_size=16):
+        self.scale = np.sqrt(np.asarray(weights, dtype=float))
+        self.dim = len(self.scale)
+        self.points = np.empty((capacity, self.dim), dtype=float)
+        self.size = 0
+        self.rebuild_ratio = rebuild_ratio
+        self.min_tail = min_tail
+        self.leaf_size = leaf_size
+        self.kdtree = None
+        self.indexed = 0 # number of points covered by the KD-tree
+
+    def __len__(self):
+        return self.size
+
+    def add(self, config):
+        '''
+        Adds a configuration to the index and returns its id
+        @param config - some configuration
+        '''
+        if self.size == len(self.points):
+            self.points = np.concatenate((self.points, np.empty_like(self.points)))
+        self.points[self.size] = np.asarray(config, dtype=float) * self.scale
+        self.size += 1
+        if self.size - self.indexed > max(self.min_tail, self.rebuild_ratio * self.indexed):
+            self.rebuild()
+        return self.size - 1
+
+    def add_many(self, configs):
+        '''
+        Adds a batch of configurations and rebuilds the KD-tree once, returns their ids
+        @param configs - configurations of shape (N, dof)
+        '''
+        configs = np.asarray(configs, dtype=float).reshape(-1, self.dim)
+        while self.size + len(configs) > len(self.points):
+            self.points = np.concatenate((self.points, np.empty_like(self.points)))
+        self.points[self.size:self.size + len(configs)] = configs * self.scale
+        self.size += len(configs)
+        self.rebuild()
+        return np.arange(self.size - len(configs), self.size)
+
+    def rebuild(self):
+        '''
+        Rebuilds the KD-tree over all the points currently in the index
+        '''
+        self.kdtree = cKDTree(self.points[:self.size], leafsize=self.leaf_size)
+        self.indexed = self.size
+
+    def _tail_dists(self, query):
+        tail = self.points[self.indexed:self.size] - query
+        return np.sqrt(np.einsum('ij,ij->i', tail, tail))
+
+    def nearest(self, config):
+        '''
+        Returns the id of the nearest configuration and its distance
+        @param config - the query configuration
+        '''
+        ids, dists = self.knn(config, 1)
+        return ids[0], dists[0]
+
+    def knn(self, config, k):
+        '''
+        Returns the ids of the k nearest configurations and their distances, closest first
+        @param config - the query configuration
+        @param k - number of neighbors to retrieve
+        '''
+        query = np.asarray(config, dtype=float) * self.scale
+        k = min(k, self.size)
+        ids = np.empty(0, dtype=int)
+        dists = np.empty(0, dtype=float)
+        if self.indexed > 0 and k > 0:
+            tree_dists, tree_ids = self.kdtree.query(query, k=min(k, self.indexed))
+            ids, dists = np.atleast_1d(tree_ids), np.atleast_1d(tree_dists)
+        if self.size > self.indexed:
+            ids = np.concatenate((ids, np.arange(self.indexed, self.size)))
+            dists = np.concatenate((dists, self._tail_dists(query)))
+        if len(ids) > k:
+            part = np.argpartition(dists, k - 1)[:k]
+            ids, dists = ids[part], dists[part]
+        order = np.argsort(dists, kind='stable')
+        return ids[order], dists[order]
+
+    def radius(self, config, r):
+        '''
+        Returns the ids of all the configurations within distance r and their distances, closest first
+        @param config - the query configuration
+        @param r - the query radius
+        '''
+        query = np.asarray(config, dtype=float) * self.scale
+        ids = np.empty(0, dtype=int)
+        if self.indexed > 0:
+            ids = np.asarray(self.kdtree.query_ball_point(query, r), dtype=int)
+        if self.size > self.indexed:
+            tail_dists = self._tail_dists(query)
+            ids = np.concatenate((ids, self.indexed + np.flatnonzero(tail_dists <= r)))
+        diff = self.points[ids] - query
+        dists = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        order = np.argsort(dists, kind='stable')
+        return ids[order], dists[order]
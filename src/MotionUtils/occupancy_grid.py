@@ -0,0 +1,124 @@
+import os
+import json
+import numpy as np
+from .kinematicsUtils import balanced_config_autocomplete
+
+
+class BalancedOccupancyGrid(object):
+    '''
+    BalancedOccupancyGrid precomputes the collision state of the balanced configurations of the UR3e.
+    A balanced configuration (balanced_config_autocomplete) is set by joints 0-2 and the sign of joint 4,
+    so for each sign a 3D grid of cells over joints 0-2 in [-pi, pi) holds one of:
+    - FREE - every configuration in the cell is collision free
+    - OCCUPIED - every configuration in the cell is in collision
+    - MIXED - the cell may hold both, its configurations are checked exactly
+    A cell is certified from the clearances at its centre: within the cell every sphere moves at most its
+    lever arm bound times the joint half widths (joint 3 moves as much as joints 1 and 2 together), so a
+    cell is FREE when every clearance exceeds that motion and OCCUPIED when one clearance stays negative.
+    The grids are saved as one .npy file in a directory named by bb.fingerprint(), and loaded memory mapped.
+    @param bb - building blocks of the UR3e the grid was computed for
+    @param states - cell states of shape (2, cells, cells, cells), for joint 4 negative and positive
+    @param bias - the balanced_config_autocomplete bias of the configurations
+    '''
+    FREE, OCCUPIED, MIXED = 0, 1, 2
+
+    def __init__(self, bb, states, bias=(0, 2.5)):
+        self.bb = bb
+        self.states = states
+        self.bias = bias
+        self.cells = states.shape[1]
+        self.width = 2 * np.pi / self.cells
+
+    @classmethod
+    def build(cls, bb, cells=64, bias=(0, 2.5), batch_size=20000):
+        '''
+        Computes the grids of bb
+        @param cells - number of cells along each joint
+        @param batch_size - number of cells certified at once
+        '''
+        engine = bb.collision_engine
+        width = 2 * np.pi / cells
+        half_widths = np.array([width / 2, width / 2, width / 2, width, 0, 0])
+        speeds = half_widths @ engine.lever_arms.T
+        pair_speeds = half_widths @ engine.pair_lever_arms.T
+        centres = -np.pi + width * (np.arange(cells) + 0.5)
+        joints = np.stack(np.meshgrid(centres, centres, centres, indexing='ij'), axis=-1).reshape(-1, 3)
+        states = np.empty((2, len(joints)), dtype=np.uint8)
+        for sign_idx, sign in enumerate((-1, 1)):
+            for start in range(0, len(joints), batch_size):
+                batch = joints[start:start + batch_size].T
+                confs = np.stack(np.broadcast_arrays(*balanced_config_autocomplete(batch, sign, bias)), axis=-1)
+                clearance, pair_clearance = engine.clearance(bb.sphere_coords_batch(confs))
+                free = np.all(clearance > speeds, axis=-1) & np.all(pair_clearance > pair_speeds, axis=-1)
+                occupied = np.any(clearance < -speeds, axis=-1) | np.any(pair_clearance < -pair_speeds, axis=-1)
+                states[sign_idx, start:start + batch_size] = np.where(
+                    free, cls.FREE, np.where(occupied, cls.OCCUPIED, cls.MIXED))
+        return cls(bb, states.reshape(2, cells, cells, cells), bias)
+
+    @staticmethod
+    def path(bb, directory, cells):
+        '''
+        Returns the file the grids of bb are saved in
+        @param directory - the directory holding the saved grids
+        '''
+        return os.path.join(directory, bb.fingerprint(), 'occupancy_{}.npy'.format(cells))
+
+    def save(self, directory):
+        '''
+        Saves the grids under directory, keyed by bb.fingerprint(), returns the file path
+        '''
+        path = self.path(self.bb, directory, self.cells)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, np.asarray(self.states))
+        meta = dict(fingerprint=self.bb.fingerprint(), robot=type(self.bb).__name__, cells=self.cells,
+                    bias=list(self.bias), fractions=self.fractions())
+        with open(path[:-len('.npy')] + '.json', 'w') as meta_file:
+            json.dump(meta, meta_file, indent=4)
+        return path
+
+    @classmethod
+    def load(cls, bb, directory, cells=64, mmap_mode='r'):
+        '''
+        Loads the grids saved for bb under directory, memory mapped. Returns None if there are none
+        '''
+        path = cls.path(bb, directory, cells)
+        if not os.path.exists(path):
+            return None
+        with open(path[:-len('.npy')] + '.json') as meta_file:
+            bias = tuple(json.load(meta_file)['bias'])
+        return cls(bb, np.load(path, mmap_mode=mmap_mode), bias)
+
+    @classmethod
+    def load_or_build(cls, bb, directory, cells=64, bias=(0, 2.5)):
+        '''
+        Loads the grids saved for bb under directory, building and saving them first if there are none
+        '''
+        grid = cls.load(bb, directory, cells)
+        if grid is None:
+            cls.build(bb, cells, bias).save(directory)
+            grid = cls.load(bb, directory, cells)
+        return grid
+
+    def fractions(self):
+        '''
+        Returns the fraction of FREE, OCCUPIED and MIXED cells
+        '''
+        counts = np.bincount(np.asarray(self.states).ravel(), minlength=3) / self.states.size
+        return dict(free=float(counts[self.FREE]), occupied=float(counts[self.OCCUPIED]),
+                    mixed=float(counts[self.MIXED]))
+
+    def lookup(self, confs):
+        '''
+        Returns the state of the cell of every configuration, MIXED for configurations that aren't balanced
+        @param confs - configurations of shape (B, 6)
+        '''
+        confs = np.asarray(confs, dtype=float)
+        joints = np.mod(confs[:, :3] + np.pi, 2 * np.pi)
+        positive = confs[:, 4] > 0
+        expected = [np.stack(np.broadcast_arrays(*balanced_config_autocomplete(confs[:, :3].T, sign, self.bias)),
+                             axis=-1) for sign in (-1, 1)]
+        difference = np.mod(confs - np.where(positive[:, None], expected[1], expected[0]) + np.pi, 2 * np.pi) - np.pi
+        balanced = np.all(np.abs(difference[:, 3:]) < 1e-9, axis=-1)
+        idx = np.minimum((joints / self.width).astype(int), self.cells - 1)
+        states = self.states[positive.astype(int), idx[:, 0], idx[:, 1], idx[:, 2]]
+        return np.where(balanced, states, self.MIXED)
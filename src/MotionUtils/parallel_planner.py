@@ -0,0 +1,85 @@
+import os
+import random
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .planner import RRT_STAR
+
+# per worker process state, set once by _init_worker
+_worker_bb = None
+_worker_best_cost = None
+
+
+def _init_worker(bb, best_cost):
+    global _worker_bb, _worker_best_cost
+    _worker_bb = bb
+    _worker_best_cost = best_cost
+
+
+def _shared_cost():
+    return _worker_best_cost.value
+
+
+def _plan_worker(start_conf, goal_conf, seed, max_step_size, max_itr, deadline, target_cost, variant):
+    np.random.seed(seed)
+    random.seed(seed)
+    planner = RRT_STAR(max_step_size, max_itr, _worker_bb, cost_bound=_shared_cost, **variant)
+
+    def share(plan, cost, elapsed):
+        with _worker_best_cost.get_lock():
+            if cost < _worker_best_cost.value:
+                _worker_best_cost.value = cost
+
+    time_budget = None if deadline is None else max(0.0, deadline - time.time())
+    plan = planner.find_path(start_conf, goal_conf, None, time_budget=time_budget, target_cost=target_cost,
+                             callback=share)
+    cost = float(planner.compute_cost(plan)) if len(plan) else np.inf
+    return plan, cost
+
+
+class ParallelPlanner(object):
+    '''
+    ParallelPlanner runs several independently seeded RRT_STAR planners, or planner variants, in a process pool
+    and returns the best plan. The building blocks are sent once to every worker process, and the workers share
+    the cost of the best plan found so far, which bounds the informed sampling and pruning of all of them.
+    @param max_step_size - the maximal extension step of the planners
+    @param bb - building blocks of the robot
+    @param num_workers - number of worker processes, defaults to the number of cores
+    @param variants - list of dicts of RRT_STAR keyword arguments, cycled over the runs.
+                      Defaults to a single informed, pruning variant
+    '''
+    def __init__(self, max_step_size, bb, num_workers=None, variants=None):
+        self.max_step_size = max_step_size
+        self.bb = bb
+        self.num_workers = os.cpu_count() if num_workers is None else num_workers
+        self.variants = [dict(informed=True, prune=True)] if variants is None else list(variants)
+        self.results = []
+
+    def find_path(self, start_conf, goal_conf, time_budget=None, max_itr=None, target_cost=None, num_runs=None,
+                  seeds=None):
+        '''
+        Plans from start_conf to goal_conf and returns the cheapest plan of all the runs, an empty array if none found.
+        The cost, seed and variant of every run are kept in self.results, cheapest first
+        @param time_budget - wall-clock seconds for the whole call, runs that didn't start by then are skipped
+        @param max_itr - iterations per run, None to only stop on the time budget or target cost
+        @param target_cost - all runs stop once any of them finds a plan costing at most this
+        @param num_runs - number of runs, defaults to num_workers
+        @param seeds - random seeds of the runs, defaults to random ones
+        '''
+        if time_budget is None and max_itr is None and target_cost is None:
+            raise ValueError("at least one of time_budget, max_itr or target_cost must be set")
+        num_runs = self.num_workers if num_runs is None else num_runs
+        seeds = [random.randrange(2 ** 31) for _ in range(num_runs)] if seeds is None else list(seeds)
+        variants = [self.variants[run % len(self.variants)] for run in range(len(seeds))]
+        deadline = None if time_budget is None else time.time() + time_budget
+        best_cost = multiprocessing.Value('d', np.inf)
+        start_conf, goal_conf = np.array(start_conf, dtype=float), np.array(goal_conf, dtype=float)
+        with ProcessPoolExecutor(self.num_workers, initializer=_init_worker, initargs=(self.bb, best_cost)) as pool:
+            futures = [pool.submit(_plan_worker, start_conf, goal_conf, seed, self.max_step_size, max_itr, deadline,
+                                   target_cost, variant) for seed, variant in zip(seeds, variants)]
+            runs = [future.result() for future in futures]
+        self.results = sorted([(cost, seed, variant) for (_, cost), seed, variant in zip(runs, seeds, variants)],
+                              key=lambda result: result[0])
+        plan, cost = min(runs, key=lambda run: run[1])
+        return plan
@@ -0,0 +1,125 @@
+import numpy as np
+
+
+class PathShortcutter(object):
+    '''
+    PathShortcutter post-processes planner output with randomized shortcutting in the edge_cost metric.
+    Every round samples a batch of waypoint pairs (i, j) and validates all of them with one edges_valid call:
+    - full shortcuts replace the waypoints between i and j with a straight edge
+    - partial shortcuts only straighten one joint group between i and j, keeping the other joints
+    Valid candidates are applied best gain first, skipping the ones overlapping an applied candidate.
+    A final greedy pass connects every waypoint to the furthest later waypoint it can reach.
+    Linear interpolation keeps linear joint constraints, so the default joint groups keep joints 1-3 together,
+    which preserves the upright/balanced constraint between them.
+    The costs and waypoint counts of the last shortcut call are kept in self.stats.
+    @param bb - building blocks of the robot
+    @param joint_groups - the joint groups partial shortcuts straighten
+    @param batch_size - number of candidates sampled per round
+    @param partial_ratio - fraction of the candidates that are partial shortcuts
+    @param tolerance - minimal cost gain for a candidate to be applied
+    '''
+    def __init__(self, bb, joint_groups=((0,), (1, 2, 3), (4,), (5,)), batch_size=32, partial_ratio=0.5,
+                 tolerance=1e-6):
+        self.bb = bb
+        self.joint_groups = [np.array(group, dtype=int) for group in joint_groups]
+        self.batch_size = batch_size
+        self.partial_ratio = partial_ratio
+        self.tolerance = tolerance
+        self.stats = dict()
+
+    def edge_costs(self, plan):
+        '''
+        Returns the edge_cost of every consecutive pair of waypoints
+        '''
+        return np.sqrt(np.power(np.diff(plan, axis=0), 2) @ self.bb.cost_weights)
+
+    def shortcut(self, plan, rounds=50):
+        '''
+        Returns the shortcut plan, with the same start and goal
+        @param plan - the configurations of the plan, of shape (N, dof)
+        @param rounds - number of randomized rounds
+        '''
+        plan = np.array(plan, dtype=float)
+        self.stats = dict(cost_before=float(self.edge_costs(plan).sum()) if len(plan) else 0.0,
+                          waypoints_before=len(plan))
+        if len(plan) > 2:
+            for _ in range(rounds):
+                if len(plan) < 3:
+                    break
+                plan = self.shortcut_round(plan)
+            plan = self.greedy_pass(plan)
+        self.stats.update(cost_after=float(self.edge_costs(plan).sum()) if len(plan) else 0.0,
+                          waypoints_after=len(plan))
+        return plan
+
+    def sample_intervals(self, size):
+        '''
+        Samples batch_size waypoint index pairs i < j at least two apart, from a plan with size waypoints
+        '''
+        i = np.random.randint(0, size - 2, self.batch_size)
+        j = i + 2 + (np.random.random(self.batch_size) * (size - i - 2)).astype(int)
+        return i, j
+
+    def shortcut_round(self, plan):
+        '''
+        Samples, validates and applies one batch of full and partial shortcuts
+        '''
+        cost_to_come = np.concatenate(([0], np.cumsum(self.edge_costs(plan))))
+        starts, ends = self.sample_intervals(len(plan))
+        groups = np.where(np.random.random(self.batch_size) < self.partial_ratio,
+                          np.random.randint(0, len(self.joint_groups), self.batch_size), -1)
+        segments, gains = [], []
+        for i, j, group in zip(starts, ends, groups):
+            if group < 0:
+                segment = plan[[i, j]]
+            else:
+                # straighten the group, spreading its motion by the cost along the original segment
+                segment = plan[i:j + 1].copy()
+                length = cost_to_come[j] - cost_to_come[i]
+                t = (cost_to_come[i:j + 1] - cost_to_come[i]) / length if length > 0 else np.zeros(j - i + 1)
+                joints = self.joint_groups[group]
+                segment[:, joints] = plan[i, joints] + t[:, None] * (plan[j, joints] - plan[i, joints])
+            segments.append(segment)
+            gains.append(cost_to_come[j] - cost_to_come[i] - self.edge_costs(segment).sum())
+        gains = np.array(gains)
+        candidates = np.flatnonzero(gains > self.tolerance)
+        if len(candidates) == 0:
+            return plan
+        valid = self.segments_valid([segments[c] for c in candidates])
+        replaced = np.zeros(len(plan), dtype=bool) # waypoints inside an applied interval
+        applied = []
+        for c in candidates[valid][np.argsort(-gains[candidates[valid]], kind='stable')]:
+            if not replaced[starts[c]:ends[c] + 1].any():
+                replaced[starts[c] + 1:ends[c]] = True
+                applied.append(c)
+        pieces, position = [], 0
+        for c in sorted(applied, key=lambda c: starts[c]):
+            pieces.append(plan[position:starts[c]])
+            pieces.append(segments[c][:-1])
+            position = ends[c]
+        pieces.append(plan[position:])
+        return np.concatenate(pieces)
+
+    def segments_valid(self, segments):
+        '''
+        Returns for each segment (a sequence of waypoints) whether all its edges are valid, with one edges_valid call
+        '''
+        prev_confs = np.concatenate([segment[:-1] for segment in segments])
+        current_confs = np.concatenate([segment[1:] for segment in segments])
+        edges_valid = self.bb.edges_valid(prev_confs, current_confs)
+        starts = np.cumsum([0] + [len(segment) - 1 for segment in segments[:-1]])
+        return np.logical_and.reduceat(edges_valid, starts)
+
+    def greedy_pass(self, plan):
+        '''
+        Connects every waypoint, from the start, to the furthest later waypoint it has a valid edge to
+        '''
+        path = [plan[0]]
+        i = 0
+        while i < len(plan) - 1:
+            later = np.arange(i + 2, len(plan))
+            valid = self.bb.edges_valid(np.repeat(plan[i][None], len(later), axis=0), plan[later])
+            reachable = later[valid]
+            i = int(reachable[-1]) if len(reachable) else i + 1
+            path.append(plan[i])
+        return np.array(path)
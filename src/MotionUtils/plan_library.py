@@ -0,0 +1,151 @@
+import os
+import json
+import numpy as np
+from scipy.spatial import cKDTree
+from .planner import RRT_CONNECT
+
+
+class PlanLibrary(object):
+    '''
+    PlanLibrary stores validated plans on disk and finds the stored plan whose start and goal are nearest to
+    a new query. Plans are kept per bb.fingerprint(), in a plan_library directory of their own since other data
+    (e.g. a Roadmap) is saved per fingerprint as well, so a stored plan is always collision free for the
+    environment and robot it is looked up with. All the waypoints are saved in one (W, dof) array, with the
+    offsets of the plans and their costs, and a KD-tree over the start and goal of every plan (scaled so that
+    distances are sqrt(edge_cost(start)^2 + edge_cost(goal)^2)) makes lookups fast.
+    A stored plan is adapted to a new query by repair, and can be used as a seed_plan for RRT_STAR.
+    @param bb - building blocks of the robot
+    @param directory - the directory holding the libraries of all environments
+    '''
+    files = ('waypoints', 'offsets', 'costs')
+
+    def __init__(self, bb, directory):
+        self.bb = bb
+        self.path = os.path.join(directory, bb.fingerprint(), 'plan_library')
+        self.scale = np.sqrt(bb.cost_weights)
+        dof = len(bb.cost_weights)
+        if all(os.path.exists(os.path.join(self.path, name + '.npy')) for name in self.files):
+            self.waypoints, self.offsets, self.costs = [np.load(os.path.join(self.path, name + '.npy'))
+                                                         for name in self.files]
+        else:
+            self.waypoints = np.zeros((0, dof))
+            self.offsets = np.zeros(1, dtype=int)
+            self.costs = np.zeros(0)
+        self.kdtree = None
+        self._index()
+
+    def __len__(self):
+        return len(self.costs)
+
+    def __getitem__(self, idx):
+        return self.waypoints[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def _index(self):
+        if len(self) == 0:
+            self.kdtree = None
+            return
+        endpoints = np.hstack((self.waypoints[self.offsets[:-1]], self.waypoints[self.offsets[1:] - 1]))
+        self.kdtree = cKDTree(endpoints * np.tile(self.scale, 2))
+
+    def save(self):
+        '''
+        Writes the library to disk, with the robot parameters it was planned for
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        for name in self.files:
+            np.save(os.path.join(self.path, name + '.npy'), getattr(self, name))
+        ur_params = self.bb.ur_params
+        meta = dict(fingerprint=self.bb.fingerprint(), robot=type(self.bb).__name__,
+                    ur_params=type(ur_params).__name__, sphere_radius=ur_params.sphere_radius, plans=len(self))
+        with open(os.path.join(self.path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file, indent=4)
+
+    def add(self, plan, validate=True, save=True):
+        '''
+        Adds a plan to the library, returns its index. Plans that aren't collision free are rejected with None
+        @param plan - the configurations of the plan, of shape (N, dof)
+        @param validate - check every edge of the plan with local_planner first
+        @param save - write the library to disk
+        '''
+        plan = np.array(plan, dtype=float)
+        if len(plan) == 0:
+            return None
+        if validate and (self.bb.is_in_collision(plan[0]) or
+                         not all(self.bb.local_planner(prev, current) for prev, current in zip(plan, plan[1:]))):
+            return None
+        cost = sum(self.bb.edge_cost(prev, current) for prev, current in zip(plan, plan[1:]))
+        self.waypoints = np.concatenate((self.waypoints, plan))
+        self.offsets = np.append(self.offsets, len(self.waypoints))
+        self.costs = np.append(self.costs, cost)
+        self._index()
+        if save:
+            self.save()
+        return len(self) - 1
+
+    def nearest(self, start_conf, goal_conf, k=1):
+        '''
+        Returns the indices of the k stored plans with the nearest start and goal, and their distances, closest first
+        '''
+        if self.kdtree is None:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        query = np.hstack((start_conf, goal_conf)) * np.tile(self.scale, 2)
+        dists, idxs = self.kdtree.query(query, k=min(k, len(self)))
+        return np.atleast_1d(idxs), np.atleast_1d(dists)
+
+    def connect(self, conf, waypoints, candidates, max_step_size, max_itr):
+        '''
+        Returns the first candidate waypoint conf can be connected to with local_planner, and the connecting
+        configurations (conf and the waypoint excluded). If none can, conf is connected to the first candidate
+        with a short RRT_CONNECT search. Returns None, None if that fails as well
+        @param waypoints - the waypoints of a plan
+        @param candidates - indices of the waypoints to try, in order
+        '''
+        for candidate in candidates:
+            if self.bb.local_planner(conf, waypoints[candidate]):
+                return candidate, []
+        plan = RRT_CONNECT(max_step_size, max_itr, self.bb).find_path(conf, waypoints[candidates[0]])
+        if len(plan) == 0:
+            return None, None
+        return candidates[0], list(plan[1:-1])
+
+    def repair(self, idx, start_conf, goal_conf, connect_k=5, max_step_size=0.8, max_itr=500):
+        '''
+        Adapts the stored plan idx to a new start and goal. Each end is connected to one of the connect_k plan
+        waypoints nearest to it, preferring the one giving the cheapest plan, and the stored plan is cut there.
+        When no direct connection is valid, a short RRT_CONNECT search bridges the gap.
+        Returns the repaired plan, an empty array if it couldn't be repaired
+        '''
+        start_conf, goal_conf = np.array(start_conf, dtype=float), np.array(goal_conf, dtype=float)
+        stored = self[idx]
+        weights = self.bb.cost_weights
+        cost_to_come = np.concatenate(([0], np.cumsum(np.sqrt(np.power(np.diff(stored, axis=0), 2) @ weights))))
+
+        to_start = np.sqrt(np.power(stored - start_conf, 2) @ weights)
+        candidates = np.argsort(to_start, kind='stable')[:connect_k]
+        candidates = candidates[np.argsort(to_start[candidates] - cost_to_come[candidates], kind='stable')]
+        first, start_gap = self.connect(start_conf, stored, candidates, max_step_size, max_itr)
+        if first is None:
+            return np.array([])
+
+        to_goal = np.sqrt(np.power(stored[first:] - goal_conf, 2) @ weights)
+        candidates = first + np.argsort(to_goal, kind='stable')[:connect_k]
+        candidates = candidates[np.argsort(to_goal[candidates - first] + cost_to_come[candidates], kind='stable')]
+        last, goal_gap = self.connect(goal_conf, stored, candidates, max_step_size, max_itr)
+        if last is None:
+            return np.array([])
+
+        plan = np.array([start_conf] + start_gap + list(stored[first:last + 1]) + goal_gap[::-1] + [goal_conf])
+        # drop the repeated waypoints where an end coincides with the stored plan
+        return plan[np.append(True, np.any(plan[1:] != plan[:-1], axis=1))]
+
+    def find_path(self, start_conf, goal_conf, k=3, **repair_args):
+        '''
+        Returns the repaired plan of the first of the k stored plans nearest to the query that can be repaired,
+        an empty array if there is none. See repair for the other arguments
+        '''
+        idxs, _ = self.nearest(start_conf, goal_conf, k)
+        for idx in idxs:
+            plan = self.repair(idx, start_conf, goal_conf, **repair_args)
+            if len(plan):
+                return plan
+        return np.array([])
@@ -1,19 +1,82 @@
 import numpy as np
-import time, sys
+import time, sys, random
+import threading
+import logging
+from math import gamma as gamma_function
 from .RRTTree import RRTTree
+from .edge_cache import EdgeValidityCache
+from .planner_stats import PlannerStats
+
+logger = logging.getLogger("LogGenerator")
 
 class RRT_STAR(object):
-    def __init__(self, max_step_size, max_itr, bb):
+    '''
+    RRT_STAR implements the RRT* planner
+    @param max_step_size - the maximal extension step, in the edge_cost metric
+    @param max_itr - number of iterations, None to only stop on the time budget, target cost or cancel
+    @param bb - building blocks of the robot
+    @param neighbourhood - 'k' to rewire the k_scale * log(n) nearest vertices, 'radius' to rewire all
+                           the vertices within min(gamma * (log(n) / n) ** (1 / dim), max_step_size)
+    @param k_scale - scale of the k-nearest rule, defaults to the RRT* bound e * (1 + 1 / dim)
+    @param gamma - scale of the shrinking radius rule, defaults to the RRT* bound computed from the
+                   volume of the joint space [-pi, pi]^dim in the edge_cost metric
+    @param dim - dimension of the sampled space, defaults to the number of joints
+    @param edge_cache_size - number of edge validity results kept in the LRU edge cache
+    @param lazy - lazy RRT*: vertices are only checked for collision at their endpoint and edges enter the
+                  tree unchecked. Edges are only collision checked once they lie on the best path to the goal,
+                  and the tree is repaired around the ones that turn out to be invalid. This runs 3.5-7.5x fewer
+                  collision checks, but each check is a larger batch, so planning is typically about 1.8x faster
+                  (0.9-3.9x over the UR5e benchmark_planner.py queries with 1000 iterations)
+    @param informed - informed RRT*: once a path of cost c is found, samples are only drawn from the states x
+                      with edge_cost(start, x) + edge_cost(x, goal) < c, the only ones that can improve the path
+    @param informed_attempts - number of samples drawn per batch when looking for an informed sample
+    @param informed_batches - number of batches drawn before giving up on an informed sample, see sample
+    @param prune - remove the tree vertices outside the informed set (and their subtrees) when the path improves
+    @param prune_threshold - only prune once the path cost dropped by this fraction since the last pruning
+    @param cost_bound - optional callable returning the cost of the best plan known elsewhere (e.g. by planners
+                        running in parallel), it bounds informed sampling, pruning and target_cost as well
+    @param log_interval - log a progress event with the stats every log_interval seconds, None for none.
+                          New solutions are logged at INFO level. Nothing is printed to the console
+    @param log_level - logging level of the progress events
+    '''
+    def __init__(self, max_step_size, max_itr, bb, neighbourhood='k', k_scale=None, gamma=None, dim=None,
+                 edge_cache_size=100000, lazy=False, informed=False, informed_attempts=100,
+                 informed_batches=100, prune=False, prune_threshold=0.05, cost_bound=None, log_interval=None,
+                 log_level=logging.DEBUG):
         self.max_step_size = max_step_size
         self.max_itr = max_itr
         self.bb = bb
+        self.lazy = lazy
+        self.informed = informed
+        self.informed_attempts = informed_attempts
+        self.informed_batches = informed_batches
+        self.informed_failed_cost = -np.inf # highest cost no informed sample was found for, see sample
+        self.prune = prune
+        self.prune_threshold = prune_threshold
+        self.cost_bound = cost_bound
+        self.cancelled = threading.Event()
+        self.log_interval = log_interval
+        self.log_level = log_level
+        self.stats = PlannerStats()
         self.tree = RRTTree(bb)
+        self.edge_cache = EdgeValidityCache(edge_cache_size)
+        if neighbourhood not in ('k', 'radius'):
+            raise ValueError("neighbourhood must be 'k' or 'radius'")
+        self.neighbourhood = neighbourhood
+        self.dim = len(bb.cost_weights) if dim is None else dim
+        self.k_scale = np.e * (1 + 1 / self.dim) if k_scale is None else k_scale
+        if gamma is None:
+            # volume of the sampled joint space and of the unit ball, both in the weighted metric
+            space_volume = np.prod(2 * np.pi * np.sqrt(bb.cost_weights[:self.dim]))
+            ball_volume = np.pi ** (self.dim / 2) / gamma_function(self.dim / 2 + 1)
+            gamma = 2 * (1 + 1 / self.dim) ** (1 / self.dim) * (space_volume / ball_volume) ** (1 / self.dim)
+        self.gamma = gamma
 
     def compute_plan(self, plan, start_idx, goal_idx):
         curr_idx = goal_idx
         while curr_idx != start_idx:
             plan.append(self.tree.vertices[curr_idx])
-            curr_idx = self.tree.edges[curr_idx]
+            curr_idx = self.tree.GetParent(curr_idx)
         plan.append(self.tree.vertices[start_idx])
         plan.reverse()
         return plan
@@ -28,41 +91,320 @@ class RRT_STAR(object):
             cost += self.bb.edge_cost(plan[i-1],plan[i])
         return cost
 
-    def find_path(self, start_conf, goal_conf, filename):
-        """Implement RRT-STAR"""
+    def find_path(self, start_conf, goal_conf, filename, seed_plan=None, time_budget=None, target_cost=None,
+                  callback=None):
+        """Implement RRT-STAR
+        Returns the best plan found, an empty array if none was found
+        @param seed_plan - optional valid plan from start_conf to goal_conf (e.g. from RRT_CONNECT),
+                           its waypoints are added to the tree as a chain before sampling starts
+        @param time_budget - stop after this many seconds, None for no limit
+        @param target_cost - stop once a plan costing at most this is found, None to keep improving
+        @param callback - called as callback(plan, cost, elapsed) on every improved plan, planning stops
+                          if it returns True
+        """
+        plan = np.array([])
+        for plan, cost, elapsed in self.solutions(start_conf, goal_conf, seed_plan, time_budget, target_cost):
+            if callback is not None and callback(plan, cost, elapsed):
+                break
+        return plan
+
+    def solutions(self, start_conf, goal_conf, seed_plan=None, time_budget=None, target_cost=None):
+        '''
+        Anytime RRT*: a generator that plans and yields (plan, cost, elapsed) each time a cheaper plan is found,
+        elapsed being the seconds since planning started. It stops after max_itr iterations (None for no limit),
+        time_budget seconds, once the cost reaches target_cost, when cancel is called or when it is closed.
+        In lazy mode only fully checked plans are yielded. See find_path for the parameters.
+        Every call plans with a new tree and edge cache, which stay available in self.tree and self.edge_cache.
+        A cancel issued after the call, even before the first iteration, stops the returned generator
+        '''
+        self.stats = PlannerStats()
+        self.tree = RRTTree(self.bb)
+        self.edge_cache = EdgeValidityCache(self.edge_cache.max_size)
+        self.cancelled.clear()
+        self.informed_failed_cost = -np.inf
+        return self._solutions(start_conf, goal_conf, seed_plan, time_budget, target_cost)
 
+    def _solutions(self, start_conf, goal_conf, seed_plan, time_budget, target_cost):
+        stats = self.stats
+        start_checks = self.bb.collision_checks
+        start_lookups = self.bb.grid_lookups
         i = 0
         self.tree.AddVertex(start_conf)
-        plan = []
+        goal_idxs = []
         goal_idx = None
-        while i < self.max_itr:
+        validated_cost = None
+        pruned_cost = np.inf
+        yielded_cost = np.inf
+        next_log = self.log_interval
+        if seed_plan is not None:
+            goal_idxs = self.add_seed_plan(seed_plan, goal_conf)
+            goal_idx = self.best_goal(goal_idxs)
+        while True:
+            stats.collision_checks = self.bb.collision_checks - start_checks
+            stats.grid_lookups = self.bb.grid_lookups - start_lookups
+            if goal_idx is not None and self.tree.costs[goal_idx] < yielded_cost:
+                yielded_cost = float(self.tree.costs[goal_idx])
+                stats.add_solution(yielded_cost)
+                logger.info("RRT* iteration %d: new solution of cost %.4f after %.3fs", i, yielded_cost, stats.elapsed())
+                yield np.array(self.compute_plan([], 0, goal_idx)), yielded_cost, stats.elapsed()
+            if next_log is not None and stats.elapsed() >= next_log:
+                logger.log(self.log_level, "RRT* iteration %d: %s", i, stats.summary())
+                next_log = stats.elapsed() + self.log_interval
+            if self.max_itr is not None and i >= self.max_itr:
+                break
+            if time_budget is not None and stats.elapsed() >= time_budget:
+                break
+            best_cost = np.inf if goal_idx is None else self.tree.costs[goal_idx]
+            if self.cost_bound is not None:
+                best_cost = min(best_cost, self.cost_bound())
+            if (target_cost is not None and best_cost <= target_cost) or self.cancelled.is_set():
+                break
             i += 1
-            self.real_k = self.get_k_num(i)
-            random_state = self.bb.sample(goal_conf)
-            nearest_state_idx, nearest_state = self.tree.GetNearestVertex(random_state)
-            new_state = self.extend(nearest_state, random_state)
-            if not self.bb.is_in_collision(new_state) and self.bb.local_planner(nearest_state,new_state):
-                if goal_idx == None:
-                    print("iteration: " + str(i))
-                else:
-                    print("iteration: " + str(i) + " goal found")
-                    if i % 100 == 0:
-                        print(plan) # to enable early stopping
-                new_state_idx = self.tree.AddVertex(new_state)
-                if all(new_state == goal_conf):
-                    goal_idx = new_state_idx
-                self.tree.AddEdge(nearest_state_idx, new_state_idx)
-                if len(self.tree.vertices) > self.real_k: # make sure the state has at least has k neighbors
-                    k_nearest_idxs, k_nearest_states = self.tree.GetKNN(new_state, self.real_k)
-                    for idx in k_nearest_idxs:
-                        self.rewire(idx, new_state_idx)
-                    for idx in k_nearest_idxs:
-                        self.rewire(new_state_idx, idx)
+            stats.iterations = i
+            with stats.timer('sample'):
+                random_state = self.sample(start_conf, goal_conf, best_cost if np.isfinite(best_cost) else None)
+                stats.samples += 1
+            with stats.timer('nearest'):
+                nearest_state_idx, nearest_state = self.tree.GetNearestVertex(random_state)
+                stats.nn_queries += 1
+            with stats.timer('extend'):
+                new_state = self.extend(nearest_state, random_state)
+                valid = not self.bb.is_in_collision(new_state)
+                if valid and not self.lazy:
+                    valid = self.bb.local_planner(nearest_state, new_state)
+                    stats.edges_checked += 1
+            if not valid:
+                continue
+            if len(goal_idxs) and all(new_state == goal_conf):
+                with stats.timer('rewire'):
+                    self.reach_goal(goal_idxs, nearest_state_idx)
             else:
-                print("iteration: " + str(i) + " in Collision")
-        if goal_idx != None:
-            self.compute_plan(plan,0, goal_idx)
-        return np.array(plan)
+                with stats.timer('near'):
+                    near_idxs, near_dists = self.get_near(new_state)
+                    new_state_idx = self.tree.AddVertex(new_state)
+                if all(new_state == goal_conf):
+                    goal_idxs.append(new_state_idx)
+                if not self.lazy:
+                    self.edge_cache.put(nearest_state_idx, new_state_idx, True)
+                with stats.timer('choose_parent'):
+                    self.choose_parent(new_state_idx, nearest_state_idx, near_idxs, near_dists)
+                with stats.timer('rewire'):
+                    self.rewire_neighbours(new_state_idx, near_idxs, near_dists)
+            goal_idx = self.best_goal(goal_idxs)
+            if self.lazy and goal_idx is not None and self.tree.costs[goal_idx] != validated_cost:
+                with stats.timer('validate'):
+                    goal_idx = self.validated_goal(goal_idxs)
+                validated_cost = None if goal_idx is None else self.tree.costs[goal_idx]
+            if goal_idx is not None:
+                best_cost = min(best_cost, self.tree.costs[goal_idx])
+            if self.prune and goal_idx is not None and best_cost < pruned_cost * (1 - self.prune_threshold):
+                with stats.timer('prune'):
+                    goal_idxs, goal_idx = self.prune_tree(start_conf, goal_conf, goal_idxs, goal_idx, best_cost)
+                stats.prunes += 1
+                pruned_cost = best_cost
+        stats.collision_checks = self.bb.collision_checks - start_checks
+        stats.grid_lookups = self.bb.grid_lookups - start_lookups
+        logger.log(self.log_level, "RRT* finished after %d iterations: %s", i, stats.summary())
+
+    def cancel(self):
+        '''
+        Stops a running find_path or solutions generator at the end of its current iteration,
+        safe to call from another thread
+        '''
+        self.cancelled.set()
+
+    def add_seed_plan(self, seed_plan, goal_conf):
+        '''
+        Adds the waypoints of a valid plan starting at the root as a chain of checked edges,
+        returns the ids of the added vertices at the goal configuration
+        @param seed_plan - the plan, its first configuration is the root
+        @param goal_conf - the goal configuration
+        '''
+        goal_idxs = []
+        prev_idx = self.tree.GetRootID()
+        for conf in seed_plan[1:]:
+            conf = np.array(conf, dtype=float)
+            idx = self.tree.AddVertex(conf)
+            self.tree.AddEdge(prev_idx, idx)
+            self.edge_cache.put(prev_idx, idx, True)
+            if all(conf == goal_conf):
+                goal_idxs.append(idx)
+            prev_idx = idx
+        return goal_idxs
+
+    def sample(self, start_conf, goal_conf, best_cost):
+        '''
+        Samples a state to extend towards. Without a solution (or when not informed) this is bb.sample,
+        otherwise states are sampled uniformly until one falls in the informed set of best_cost.
+        The set lies within |x_i - centre_i| <= best_cost / (2 * sqrt(w_i)) of the midpoint of the start and
+        goal, so samples are drawn from that box. If none of informed_batches batches falls in the set, the
+        sampled space may miss the set entirely (e.g. when the start or goal isn't an upright configuration),
+        so for that cost and lower ones samples are drawn from the box without rejection
+        @param start_conf - the start configuration
+        @param goal_conf - the goal configuration
+        @param best_cost - the cost of the best path found so far, None if there is none
+        '''
+        if not self.informed or best_cost is None:
+            return self.bb.sample(goal_conf)
+        if random.random() < self.bb.p_bias:
+            return np.array(goal_conf)
+        # the sampled space is the upright configurations, which the informed ellipsoid can't be
+        # sampled on directly, so samples are rejected instead
+        centre = (np.asarray(start_conf) + np.asarray(goal_conf)) / 2
+        half_widths = best_cost / (2 * np.sqrt(self.bb.cost_weights))
+        if best_cost <= self.informed_failed_cost:
+            return self.bb.sample_uniform(None, centre - half_widths, centre + half_widths)
+        for _ in range(self.informed_batches):
+            states = self.bb.sample_uniform(self.informed_attempts, centre - half_widths, centre + half_widths)
+            informed = np.flatnonzero(self.heuristic_costs(start_conf, goal_conf, states) < best_cost)
+            if len(informed):
+                return states[informed[0]]
+        logger.info("RRT*: no informed sample for cost %.4f in %d batches, sampling its bounding box from now on",
+                    best_cost, self.informed_batches)
+        self.informed_failed_cost = best_cost
+        return states[0]
+
+    def heuristic_costs(self, start_conf, goal_conf, configs):
+        '''
+        Returns edge_cost(start, x) + edge_cost(x, goal) for every configuration x, a lower bound
+        on the cost of any path from start to goal through x
+        @param configs - configurations of shape (N, dof)
+        '''
+        weights = self.bb.cost_weights
+        to_start = np.sqrt(np.power(configs - start_conf, 2) @ weights)
+        to_goal = np.sqrt(np.power(configs - goal_conf, 2) @ weights)
+        return to_start + to_goal
+
+    def prune_tree(self, start_conf, goal_conf, goal_idxs, goal_idx, best_cost):
+        '''
+        Removes the vertices that can't improve on best_cost, with their subtrees.
+        The vertices on the path are always kept. Vertex ids change, so the ids of the goal vertices
+        are returned renumbered, and the edge cache is renumbered as well
+        @param goal_idxs - ids of the vertices at the goal configuration
+        @param goal_idx - id of the goal vertex with the best path
+        @param best_cost - the cost of the best known plan, at most the cost of the path to goal_idx
+        '''
+        costs = self.heuristic_costs(start_conf, goal_conf, self.tree.vertices)
+        useful = costs <= best_cost
+        curr_idx = goal_idx
+        while curr_idx >= 0:
+            useful[curr_idx] = True
+            curr_idx = self.tree.GetParent(curr_idx)
+        keep = [self.tree.GetRootID()]
+        i = 0
+        while i < len(keep):
+            keep.extend(child for child in self.tree.GetChildren(keep[i]) if useful[child])
+            i += 1
+        if len(keep) == len(self.tree):
+            return goal_idxs, goal_idx
+        new_ids = self.tree.Prune(keep)
+        self.edge_cache.remap(new_ids)
+        goal_idxs = [int(new_ids[idx]) for idx in goal_idxs if new_ids[idx] >= 0]
+        return goal_idxs, int(new_ids[goal_idx])
+
+    def reach_goal(self, goal_idxs, nearest_idx):
+        '''
+        Handles an extension from the nearest vertex that reached a goal already in the tree: instead of adding
+        another goal vertex, the best goal vertex (or a cut off one) is re-parented to the nearest vertex if
+        that lowers its cost-to-come. The edge was already checked, unless in lazy mode
+        @param goal_idxs - ids of the vertices at the goal configuration
+        @param nearest_idx - the id of the vertex the extension started from
+        '''
+        goal_idx = self.best_goal(goal_idxs)
+        if goal_idx is None:
+            goal_idx = goal_idxs[0]
+        if nearest_idx == goal_idx:
+            return
+        if not self.lazy:
+            self.edge_cache.put(nearest_idx, goal_idx, True)
+        dist = self.bb.edge_cost(self.tree.vertices[nearest_idx], self.tree.vertices[goal_idx])
+        self.rewire_neighbours(nearest_idx, np.array([goal_idx]), np.array([dist]))
+
+    def best_goal(self, goal_idxs):
+        '''
+        Returns the goal vertex with the lowest cost-to-come, None if no goal vertex is connected to the root
+        @param goal_idxs - ids of the vertices at the goal configuration
+        '''
+        if len(goal_idxs) == 0:
+            return None
+        goal_idx = goal_idxs[int(np.argmin(self.tree.costs[goal_idxs]))]
+        return goal_idx if np.isfinite(self.tree.costs[goal_idx]) else None
+
+    def validated_goal(self, goal_idxs):
+        '''
+        Lazy mode: returns the goal vertex with the lowest cost-to-come whose path is fully checked, None if
+        there is none. Repairing the path to one goal can make another goal the best one, and its path may
+        hold unchecked edges as well, so goals are validated until the best one has a valid path
+        @param goal_idxs - ids of the vertices at the goal configuration
+        '''
+        goal_idx = self.best_goal(goal_idxs)
+        while goal_idx is not None and not self.validate_path(goal_idx):
+            goal_idx = self.best_goal(goal_idxs)
+        return goal_idx
+
+    def validate_path(self, goal_idx):
+        '''
+        Lazy mode: collision checks, in one batch, the unchecked edges on the tree path to goal_idx.
+        Invalid edges are removed, and the vertices below them are reconnected to their best
+        neighbour, until the path is fully checked or the goal is cut off from the root.
+        Returns whether the path to goal_idx is valid
+        @param goal_idx - the id of the goal vertex
+        '''
+        while np.isfinite(self.tree.costs[goal_idx]):
+            unchecked = []
+            curr_idx = goal_idx
+            while curr_idx != self.tree.GetRootID():
+                if not self.tree.edge_checked[curr_idx]:
+                    unchecked.append(curr_idx)
+                curr_idx = self.tree.GetParent(curr_idx)
+            if len(unchecked) == 0:
+                return True
+            unchecked.reverse() # root side first
+            parents = self.tree.parents[unchecked]
+            valid = self.bb.edges_valid(self.tree.vertices[parents], self.tree.vertices[unchecked])
+            self.stats.edges_checked += len(unchecked)
+            invalid = []
+            for idx, parent_idx, edge_valid in zip(unchecked, parents, valid):
+                self.edge_cache.put(parent_idx, idx, edge_valid)
+                if edge_valid:
+                    self.tree.edge_checked[idx] = True
+                else:
+                    self.tree.RemoveEdge(idx)
+                    invalid.append(idx)
+            for idx in invalid:
+                self.reconnect(idx)
+        return False
+
+    def reconnect(self, idx):
+        '''
+        Lazy mode: connects a vertex that was cut off from the root to the neighbour giving it the lowest cost,
+        skipping edges that are known to be invalid. The new edge is unchecked unless it was checked before
+        @param idx - the id of the cut off vertex
+        '''
+        near_idxs, near_dists = self.connected_near(idx)
+        candidate_costs = self.tree.costs[near_idxs] + near_dists
+        for j in np.argsort(candidate_costs, kind='stable'):
+            if not np.isfinite(candidate_costs[j]):
+                break
+            usable, checked = self.edge_usable(near_idxs[j], idx)
+            if usable:
+                self.tree.AddEdge(near_idxs[j], idx, near_dists[j], checked=checked)
+                return
+
+    def connected_near(self, idx):
+        '''
+        Lazy mode: returns the neighbours of a cut off vertex and the edge costs to them, like get_near.
+        Other cut off vertices (e.g. copies of the goal) can fill the whole k-nearest neighbourhood, so it is
+        widened until it holds k vertices still connected to the root, or the whole tree
+        @param idx - the id of the cut off vertex
+        '''
+        near_idxs, near_dists = self.get_near(self.tree.vertices[idx])
+        if self.neighbourhood == 'k':
+            k = len(near_idxs)
+            while np.isfinite(self.tree.costs[near_idxs]).sum() < k and len(near_idxs) < len(self.tree):
+                near_idxs, near_dists = self.tree.GetKNN(self.tree.vertices[idx], 2 * len(near_idxs))
+                self.stats.nn_queries += 1
+        return near_idxs, near_dists
 
     def extend(self, x_near, x_random)-> np.array:
         '''
@@ -79,87 +421,195 @@ class RRT_STAR(object):
         new_state = x_near + (n * normed_direction)
         return new_state
 
-    def rewire_children(self, parent_idx, parent_cost):
-        # Get the list of children vertices
-        children_idxs = [idx for idx, parent in self.tree.edges.items() if parent == parent_idx]
+    def choose_parent(self, new_idx, nearest_idx, near_idxs, near_dists):
+        '''
+        Connects a new vertex to the neighbour that gives it the lowest cost-to-come.
+        The edge from the nearest vertex is already known to be valid (or assumed valid in lazy mode),
+        so only the neighbours that improve on it are collision checked, cheapest first.
+        @param new_idx - the id of the new vertex
+        @param nearest_idx - the id of the nearest vertex
+        @param near_idxs - ids of the neighbours of the new vertex
+        @param near_dists - edge costs from the neighbours to the new vertex
+        '''
+        new_state = self.tree.vertices[new_idx]
+        nearest_cost = self.bb.edge_cost(self.tree.vertices[nearest_idx], new_state)
+        best_cost = self.tree.costs[nearest_idx] + nearest_cost
+        candidate_costs = self.tree.costs[near_idxs] + near_dists
+        for j in np.argsort(candidate_costs, kind='stable'):
+            if not candidate_costs[j] < best_cost:
+                break
+            usable, checked = self.edge_usable(near_idxs[j], new_idx)
+            if usable:
+                self.tree.AddEdge(near_idxs[j], new_idx, near_dists[j], checked=checked)
+                return near_idxs[j]
+        self.tree.AddEdge(nearest_idx, new_idx, nearest_cost, checked=not self.lazy)
+        return nearest_idx
 
-        # Iterate through the children and rewire them if necessary
-        for child_idx in children_idxs:
-            child_vertex = self.tree.vertices[child_idx]
+    def rewire_neighbours(self, new_idx, near_idxs, near_dists):
+        '''
+        Re-parents to the new vertex every neighbour whose cost-to-come it improves.
+        Only edges that improve the cost are collision checked, largest improvement first.
+        @param new_idx - the id of the new vertex
+        @param near_idxs - ids of the neighbours of the new vertex
+        @param near_dists - edge costs from the new vertex to the neighbours
+        '''
+        with np.errstate(invalid='ignore'): # inf - inf between vertices cut off by lazy repairs
+            gains = self.tree.costs[near_idxs] - (self.tree.costs[new_idx] + near_dists)
+        root = self.tree.GetRootID()
+        for j in np.argsort(-gains, kind='stable'):
+            if not gains[j] > 0:
+                break
+            idx = near_idxs[j]
+            # an earlier rewire in this loop may already have lowered the cost of this neighbour
+            if idx == root or not self.tree.costs[new_idx] + near_dists[j] < self.tree.costs[idx]:
+                continue
+            usable, checked = self.edge_usable(new_idx, idx)
+            if usable:
+                self.tree.AddEdge(new_idx, idx, near_dists[j], checked=checked)
+                self.stats.rewires += 1
 
-            # Recompute the cost of the child considering the new parent
+    def edge_valid(self, a_idx, b_idx):
+        '''
+        Returns whether the edge between two tree vertices is collision free, through the edge cache
+        @param a_idx - the id of one vertex
+        @param b_idx - the id of the other vertex
+        '''
+        valid = self.edge_cache.get(a_idx, b_idx)
+        if valid is None:
+            valid = self.bb.local_planner(self.tree.vertices[a_idx], self.tree.vertices[b_idx])
+            self.stats.edges_checked += 1
+            self.edge_cache.put(a_idx, b_idx, valid)
+        return valid
 
-            new_cost = parent_cost + self.bb.edge_cost(self.tree.vertices[parent_idx], child_vertex)
+    def edge_usable(self, a_idx, b_idx):
+        '''
+        Returns whether an edge may enter the tree, and whether it was collision checked.
+        Lazy mode doesn't check edges, it only rejects the ones already known to be invalid
+        @param a_idx - the id of one vertex
+        @param b_idx - the id of the other vertex
+        '''
+        if not self.lazy:
+            return self.edge_valid(a_idx, b_idx), True
+        valid = self.edge_cache.peek(a_idx, b_idx)
+        if valid is None:
+            return True, False
+        return valid, True
 
-            # If the new cost is lower than the child's current cost, update the child's cost and rewire its children recursively
+    def get_near(self, config):
+        '''
+        Returns the ids of the tree vertices in the RRT* neighbourhood of a configuration and their distances
+        @param config - some configuration
+        '''
+        n = len(self.tree)
+        self.stats.nn_queries += 1
+        if self.neighbourhood == 'radius':
+            return self.tree.GetNearVertices(config, self.get_radius(n))
+        return self.tree.GetKNN(config, self.get_k_num(n))
 
-            _, child_cost = self.get_shortest_path(child_idx)
-            if new_cost < child_cost:
-                self.rewire_children(child_idx,new_cost)
+    def get_k_num(self, n):
+        '''
+        Determines the number of K nearest neighbors for a tree with n vertices
+        '''
+        return max(1, int(np.ceil(self.k_scale * np.log(n + 1))))
 
-    def rewire(self, x_potential_parent_id, x_child_id) -> None:
+    def get_radius(self, n):
         '''
-        Implement the rewire method
-        @param x_potential_parent_id - candidte to become a parent
-        @param x_child_id - the id of the child vertex
-        return None
+        Determines the rewiring radius for a tree with n vertices
         '''
+        n = max(n, 2)
+        return min(self.gamma * (np.log(n) / n) ** (1 / self.dim), self.max_step_size)
 
-        if(x_child_id >= len(self.tree.vertices) or x_potential_parent_id >= len(self.tree.vertices)):
-            return None
 
-        # Get the child and potential parent vertices
-        child_vertex = self.tree.vertices[x_child_id]
-        potential_parent_vertex = self.tree.vertices[x_potential_parent_id]
+class RRT_CONNECT(object):
+    '''
+    RRT_CONNECT implements the bidirectional RRT-Connect planner: one tree grows from the start and one
+    from the goal, each extension of one tree is followed by a greedy attempt to connect the other tree
+    to the new vertex, and the trees swap roles every iteration. It returns the first path found, which
+    can be used as is or as a seed_plan for RRT_STAR
+    @param max_step_size - the maximal extension step, in the edge_cost metric
+    @param max_itr - number of iterations
+    @param bb - building blocks of the robot
+    '''
+    TRAPPED, ADVANCED, REACHED = range(3)
 
-        # Check if the edge between potential parent and child is valid
-        if not self.bb.local_planner(potential_parent_vertex, child_vertex):
-            return None
+    def __init__(self, max_step_size, max_itr, bb):
+        self.max_step_size = max_step_size
+        self.max_itr = max_itr
+        self.bb = bb
+        self.start_tree = RRTTree(bb)
+        self.goal_tree = RRTTree(bb)
+
+    # same steering rule as RRT_STAR
+    extend = RRT_STAR.extend
 
-        # Compute the cost of the edge between potential parent and child
-        edge_cost = self.bb.edge_cost(potential_parent_vertex, child_vertex)
+    def find_path(self, start_conf, goal_conf, filename=None):
+        '''
+        Returns the plan from start_conf to goal_conf as an array, empty if none was found within max_itr.
+        Every call plans with new trees, which stay available in self.start_tree and self.goal_tree
+        '''
+        self.start_tree = RRTTree(self.bb)
+        self.goal_tree = RRTTree(self.bb)
+        self.start_tree.AddVertex(np.array(start_conf, dtype=float))
+        self.goal_tree.AddVertex(np.array(goal_conf, dtype=float))
+        tree_a, tree_b = self.start_tree, self.goal_tree
+        for i in range(self.max_itr):
+            # sampling is biased towards the root of the other tree
+            random_state = self.bb.sample(tree_b.vertices[tree_b.GetRootID()])
+            status, new_idx = self.extend_tree(tree_a, random_state)
+            if status != self.TRAPPED:
+                status, connect_idx = self.connect_tree(tree_b, tree_a.vertices[new_idx])
+                if status == self.REACHED:
+                    if tree_a is self.start_tree:
+                        return self.join_plans(new_idx, connect_idx)
+                    return self.join_plans(connect_idx, new_idx)
+            tree_a, tree_b = tree_b, tree_a
+        return np.array([])
 
-        # Calculate the total cost if we rewire the child to the potential parent
-        _, potential_parent_cost = self.get_shortest_path(x_potential_parent_id)
-        total_cost = potential_parent_cost + edge_cost
+    def extend_tree(self, tree, config):
+        '''
+        Extends a tree one step towards a configuration, returns the status and the id of the new vertex
+        @param tree - the tree to extend
+        @param config - the target configuration
+        '''
+        nearest_idx, nearest_state = tree.GetNearestVertex(config)
+        new_state = np.array(self.extend(nearest_state, config), dtype=float)
+        if self.bb.is_in_collision(new_state) or not self.bb.local_planner(nearest_state, new_state):
+            return self.TRAPPED, None
+        new_idx = tree.AddVertex(new_state)
+        tree.AddEdge(nearest_idx, new_idx)
+        if np.array_equal(new_state, config):
+            return self.REACHED, new_idx
+        return self.ADVANCED, new_idx
 
-        # Check if rewiring reduces the cost of the child
-        _, child_cost = self.get_shortest_path(x_child_id)
-        if not total_cost < child_cost:
-            return None
+    def connect_tree(self, tree, config):
+        '''
+        Extends a tree towards a configuration until it reaches it or gets trapped
+        @param tree - the tree to extend
+        @param config - the target configuration
+        '''
+        status, idx = self.ADVANCED, None
+        while status == self.ADVANCED:
+            status, new_idx = self.extend_tree(tree, config)
+            if new_idx is not None:
+                idx = new_idx
+        return status, idx
+
+    def tree_plan(self, tree, idx):
+        '''
+        Returns the configurations from the root of a tree to one of its vertices
+        '''
+        plan = []
+        while idx != tree.GetRootID():
+            plan.append(tree.vertices[idx])
+            idx = tree.GetParent(idx)
+        plan.append(tree.vertices[idx])
+        plan.reverse()
+        return plan
 
-        # Update the existing edge if it exists
-        if x_child_id in self.tree.edges:
-            # Update the cost of the child
-            child_cost = total_cost
-            # Update the parent of the child to the potential parent
-            self.tree.edges[x_child_id] = x_potential_parent_id
-            # Rewire children recursively if necessary
-            self.rewire_children(x_child_id,potential_parent_cost)
-
-    def get_shortest_path(self, dest):
-        '''
-        Returns the path and cost from some vertex to Tree's root
-        @param dest - the id of some vertex
-        return the shortest path and the cost
-        '''
-        # TODO
-        path = self.compute_plan([],0, dest)
-        cost = self.compute_cost(path)
-        return path, cost
-
-    def get_k_num(self, i):
-        '''
-        Determines the number of K nearest neighbors for each iteration
-        '''
-        if i < 300:
-            k_num = 1
-        elif 300 <= i < 600:
-            k_num = 3
-        elif 600 <= i < 1000:
-            k_num=5
-        elif 1000 <= i < 1500:
-            k_num=6
-        else:
-            k_num = 7
-        return k_num
+    def join_plans(self, start_idx, goal_idx):
+        '''
+        Joins the start tree path to start_idx and the goal tree path to goal_idx, which are the same configuration
+        '''
+        start_plan = self.tree_plan(self.start_tree, start_idx)
+        goal_plan = self.tree_plan(self.goal_tree, goal_idx)
+        return np.array(start_plan + goal_plan[::-1][1:])
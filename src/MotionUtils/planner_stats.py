@@ -0,0 +1,89 @@
+import time
+
+
+class PhaseTimer(object):
+    '''
+    Context manager adding the time spent in its block to a phase of a PlannerStats
+    '''
+    __slots__ = ('stats', 'phase', 'start')
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        phase_times = self.stats.phase_times
+        phase_times[self.phase] = phase_times.get(self.phase, 0.0) + time.perf_counter() - self.start
+
+
+class PlannerStats(object):
+    '''
+    PlannerStats holds the counters and timers of one planner run:
+    - iterations - planner iterations
+    - samples - sampled states
+    - collision_checks - configurations checked for collision (states and interpolated edge configurations)
+    - grid_lookups - configurations whose collision check was answered by an occupancy grid lookup instead
+    - edges_checked - edges collision checked with the local planner
+    - nn_queries - nearest neighbour queries on the tree
+    - rewires - vertices re-parented to a cheaper parent
+    - prunes - tree prunings
+    - phase_times - seconds spent in each planner phase
+    - cost_curve - (elapsed seconds, cost) of every improved solution
+    Counters are plain attributes, incremented in place, so they cost next to nothing.
+    '''
+    counters = ('iterations', 'samples', 'collision_checks', 'grid_lookups', 'edges_checked', 'nn_queries', 'rewires',
+                'prunes')
+
+    def __init__(self):
+        for counter in self.counters:
+            setattr(self, counter, 0)
+        self.phase_times = dict()
+        self.cost_curve = []
+        self.start_time = time.perf_counter()
+
+    def elapsed(self):
+        '''
+        Returns the seconds since the run started
+        '''
+        return time.perf_counter() - self.start_time
+
+    def timer(self, phase):
+        '''
+        Returns a context manager timing a phase
+        @param phase - the phase name
+        '''
+        return PhaseTimer(self, phase)
+
+    def add_solution(self, cost):
+        '''
+        Records an improved solution on the cost curve
+        '''
+        self.cost_curve.append((self.elapsed(), float(cost)))
+
+    @property
+    def time_to_first_solution(self):
+        return self.cost_curve[0][0] if self.cost_curve else None
+
+    @property
+    def best_cost(self):
+        return self.cost_curve[-1][1] if self.cost_curve else None
+
+    def as_dict(self):
+        '''
+        Returns the stats as a JSON serializable dict
+        '''
+        stats = {counter: getattr(self, counter) for counter in self.counters}
+        stats.update(elapsed=self.elapsed(), phase_times=dict(self.phase_times), cost_curve=list(self.cost_curve),
+                     time_to_first_solution=self.time_to_first_solution, best_cost=self.best_cost)
+        return stats
+
+    def summary(self):
+        '''
+        Returns a one line summary of the counters, for log events
+        '''
+        counters = ', '.join('{} {}'.format(counter, getattr(self, counter)) for counter in self.counters)
+        return '{:.3f}s, {}, best cost {}'.format(self.elapsed(), counters, self.best_cost)
@@ -0,0 +1,181 @@
+import os
+import json
+import heapq
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class Roadmap(object):
+    '''
+    Roadmap implements a PRM: collision free configurations sampled through bb.sample_uniform, each connected
+    to its k nearest neighbours (in the edge_cost metric) with local_planner. The graph is kept in CSR form,
+    a row pointer array into flat neighbour and edge cost arrays, which is saved as .npy files in a directory
+    named by bb.fingerprint(), and loaded back memory mapped. A query is an A* search over the graph
+    plus connecting the start and goal to their nearest roadmap vertices.
+    @param bb - building blocks of the robot
+    @param vertices - roadmap configurations of shape (N, dof)
+    @param indptr - the neighbours of vertex i are indices[indptr[i]:indptr[i + 1]]
+    @param indices - flat neighbour ids
+    @param costs - flat edge costs, matching indices
+    '''
+    files = ('vertices', 'indptr', 'indices', 'costs')
+
+    def __init__(self, bb, vertices, indptr, indices, costs):
+        self.bb = bb
+        self.vertices = vertices
+        self.indptr = indptr
+        self.indices = indices
+        self.costs = costs
+        self.scale = np.sqrt(bb.cost_weights)
+        self.kdtree = cKDTree(np.asarray(vertices) * self.scale) if len(vertices) else None
+
+    def __len__(self):
+        return len(self.vertices)
+
+    @classmethod
+    def build(cls, bb, num_samples=2000, k=15, edge_checker=None, batch_size=2000):
+        '''
+        Samples a new roadmap
+        @param num_samples - number of sampled configurations, the ones in collision are dropped
+        @param k - number of nearest neighbours each vertex is connected to
+        @param edge_checker - object with an edges_valid(prev_confs, current_confs) method, bb by default.
+                              A CollisionPool spreads the edge checks over several processes
+        @param batch_size - number of edges validated per edges_valid call
+        '''
+        edge_checker = bb if edge_checker is None else edge_checker
+        samples = bb.sample_uniform(num_samples)
+        vertices = samples[~bb.configs_in_collision(samples)]
+        if len(vertices) < 2:
+            # nothing to connect, an edgeless roadmap
+            return cls(bb, vertices, np.zeros(len(vertices) + 1, dtype=int), np.zeros(0, dtype=int), np.zeros(0))
+        scale = np.sqrt(bb.cost_weights)
+        dists, neighbours = cKDTree(vertices * scale).query(vertices * scale, k=min(k + 1, len(vertices)))
+        # undirected candidate edges, each pair once
+        sources = np.repeat(np.arange(len(vertices)), neighbours.shape[1])
+        pairs = np.stack((sources, neighbours.ravel()), axis=1)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+        valid = np.concatenate([np.zeros(0, dtype=bool)] +
+                               [edge_checker.edges_valid(vertices[pairs[start:start + batch_size, 0]],
+                                                         vertices[pairs[start:start + batch_size, 1]])
+                                for start in range(0, len(pairs), batch_size)])
+        pairs = pairs[valid]
+        # both directions, sorted by source vertex
+        edges = np.concatenate((pairs, pairs[:, ::-1]))
+        edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+        indptr = np.searchsorted(edges[:, 0], np.arange(len(vertices) + 1))
+        diff = vertices[edges[:, 0]] - vertices[edges[:, 1]]
+        costs = np.sqrt(np.power(diff, 2) @ bb.cost_weights)
+        return cls(bb, vertices, indptr, edges[:, 1].copy(), costs)
+
+    @staticmethod
+    def path(bb, directory):
+        '''
+        Returns the directory the roadmap of bb is saved in
+        @param directory - the directory holding the saved roadmaps
+        '''
+        return os.path.join(directory, bb.fingerprint())
+
+    def save(self, directory, **meta):
+        '''
+        Saves the roadmap under directory, keyed by bb.fingerprint(), returns its path
+        @param meta - extra build parameters to record with it
+        '''
+        path = self.path(self.bb, directory)
+        os.makedirs(path, exist_ok=True)
+        for name in self.files:
+            np.save(os.path.join(path, name + '.npy'), np.asarray(getattr(self, name)))
+        meta.update(fingerprint=self.bb.fingerprint(), robot=type(self.bb).__name__, vertices=len(self),
+                    edges=len(self.indices) // 2)
+        with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file, indent=4)
+        return path
+
+    @classmethod
+    def load(cls, bb, directory, mmap_mode='r'):
+        '''
+        Loads the roadmap saved for bb under directory, memory mapped. Returns None if there is none
+        '''
+        path = cls.path(bb, directory)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in cls.files]
+        return cls(bb, *arrays)
+
+    @classmethod
+    def load_or_build(cls, bb, directory, num_samples=2000, k=15, edge_checker=None):
+        '''
+        Loads the roadmap saved for bb under directory, building and saving it first if there is none
+        '''
+        roadmap = cls.load(bb, directory)
+        if roadmap is None:
+            roadmap = cls.build(bb, num_samples, k, edge_checker)
+            roadmap.save(directory, num_samples=num_samples, k=k)
+            roadmap = cls.load(bb, directory)
+        return roadmap
+
+    def neighbours(self, vid):
+        '''
+        Returns the neighbour ids of a roadmap vertex and the costs of the edges to them
+        '''
+        start, end = self.indptr[vid], self.indptr[vid + 1]
+        return self.indices[start:end], self.costs[start:end]
+
+    def connect(self, config, k):
+        '''
+        Returns the nearest roadmap vertex that config can be connected to with local_planner,
+        trying the k nearest in order, None if none of them can
+        '''
+        dists, vids = self.kdtree.query(np.asarray(config, dtype=float) * self.scale, k=min(k, len(self)))
+        for vid in np.atleast_1d(vids):
+            if self.bb.local_planner(config, self.vertices[vid]):
+                return int(vid)
+        return None
+
+    def find_path(self, start_conf, goal_conf, connect_k=10):
+        '''
+        Returns a plan from start_conf to goal_conf through the roadmap, an empty array if there is none
+        @param connect_k - number of nearest roadmap vertices tried when connecting the start and the goal
+        '''
+        start_conf, goal_conf = np.array(start_conf, dtype=float), np.array(goal_conf, dtype=float)
+        if len(self) == 0:
+            return np.array([])
+        start_vid = self.connect(start_conf, connect_k)
+        goal_vid = self.connect(goal_conf, connect_k) if start_vid is not None else None
+        if goal_vid is None:
+            return np.array([])
+        vids = self.search(start_vid, goal_vid)
+        if vids is None:
+            return np.array([])
+        return np.array([start_conf] + [self.vertices[vid] for vid in vids] + [goal_conf])
+
+    def search(self, start_vid, goal_vid):
+        '''
+        A* search between two roadmap vertices, with the edge_cost to the goal as heuristic.
+        Returns the ids of the vertices on the path, None if they aren't connected
+        '''
+        goal = np.asarray(self.vertices[goal_vid])
+        heuristic = lambda vid: self.bb.edge_cost(np.asarray(self.vertices[vid]), goal)
+        cost_to_come = {start_vid: 0.0}
+        parents = {start_vid: -1}
+        queue = [(heuristic(start_vid), start_vid)]
+        closed = set()
+        while queue:
+            _, vid = heapq.heappop(queue)
+            if vid == goal_vid:
+                path = []
+                while vid >= 0:
+                    path.append(vid)
+                    vid = parents[vid]
+                return path[::-1]
+            if vid in closed:
+                continue
+            closed.add(vid)
+            neighbours, costs = self.neighbours(vid)
+            for neighbour, cost in zip(neighbours.tolist(), costs.tolist()):
+                new_cost = cost_to_come[vid] + cost
+                if new_cost < cost_to_come.get(neighbour, np.inf):
+                    cost_to_come[neighbour] = new_cost
+                    parents[neighbour] = vid
+                    heapq.heappush(queue, (new_cost + heuristic(neighbour), neighbour))
+        return None